@@ -1,44 +1,114 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from firebase_admin import credentials, auth as firebase_auth, initialize_app
-from db import db
-import traceback
-
-try:
-    cred = credentials.Certificate("serviceAccountKey.json")
-    initialize_app(cred)
-    print("Firebase Admin initialized successfully")
-except Exception as e:
-    print(f"Firebase Admin initialization failed: {e} - Stacktrace: {traceback.format_exc()}")
-
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000", "https://internetbutfun.vercel.app"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-async def get_current_user(request: Request):
-    print("=== TOKEN DEBUG ===")
-    token = request.headers.get("Authorization")
-    print(f"Raw Authorization header: {token}")
-    
-    if not token or not token.startswith("Bearer "):
-        print("Missing or invalid token format")
-        raise HTTPException(status_code=401, detail="Missing or invalid token")
-
-    try:
-        token_value = token.split(" ")[1]
-        print(f"Extracted token: {token_value[:50]}...")
-        decoded = firebase_auth.verify_id_token(token_value, clock_skew_seconds=60)
-        print(f"Token decoded successfully for user: {decoded.get('email')}")
-        return decoded
-    except firebase_auth.InvalidIdTokenError as e:
-        print(f"Invalid token error: {str(e)}")
-        raise HTTPException(status_code=401, detail=f"Invalid Firebase token: {str(e)}")
-    except Exception as e:
-        print(f"Unexpected error in token verification: {str(e)} - Stacktrace: {traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
\ No newline at end of file
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.exception_handlers import http_exception_handler
+from fastapi.middleware.cors import CORSMiddleware
+from firebase_admin import credentials, auth as firebase_auth, initialize_app
+from cachetools import TLRUCache
+from db import db
+from serialization import ContentNegotiationMiddleware, NegotiatedResponse
+from metrics import MetricsMiddleware
+from logs import REQUEST_ID_HEADER, RequestContextMiddleware, setup_logging
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+setup_logging()
+log = logging.getLogger(__name__)
+
+try:
+    cred = credentials.Certificate("serviceAccountKey.json")
+    initialize_app(cred)
+    log.info("Firebase Admin initialized successfully")
+except Exception as e:
+    log.exception("Firebase Admin initialization failed: %s", e)
+
+app = FastAPI(default_response_class=NegotiatedResponse)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:3000", "https://internetbutfun.vercel.app"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", REQUEST_ID_HEADER],
+)
+app.add_middleware(ContentNegotiationMiddleware)
+app.add_middleware(RequestContextMiddleware)
+# Added last so it is outermost and times the whole request.
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(HTTPException)
+async def log_server_errors(request: Request, exc: HTTPException):
+    # Routes turn unexpected exceptions into a 500; the original is the HTTPException's context.
+    if exc.status_code >= 500:
+        cause = exc.__context__ or exc
+        log.error("%s %s failed: %s", request.method, request.url.path, exc.detail,
+                  exc_info=(type(cause), cause, cause.__traceback__))
+    return await http_exception_handler(request, exc)
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Firebase uids allowed to read the diagnostic endpoints that expose query details.
+ADMIN_UIDS = {uid.strip() for uid in os.getenv("ADMIN_UIDS", "").split(",") if uid.strip()}
+
+def _token_expiry(key, decoded, now):
+    # Cached claims are dropped exactly when the token itself stops being valid.
+    return decoded.get("exp", now)
+
+_token_cache = TLRUCache(maxsize=TOKEN_CACHE_SIZE, ttu=_token_expiry, timer=time.time)
+_token_inflight = {}
+
+def _token_key(token_value: str):
+    return hashlib.sha256(token_value.encode()).hexdigest()
+
+def _settle_token(key, check: asyncio.Task):
+    _token_inflight.pop(key, None)
+    if check.cancelled():
+        return
+    # Reading the exception marks it retrieved even when every caller has gone.
+    if check.exception() is None:
+        _token_cache[key] = check.result()
+
+async def verify_token(token_value: str):
+    """Verify a Firebase ID token, serving repeat tokens from an in-process cache.
+
+    Cache misses run the signature check on a worker thread so it never blocks
+    the event loop, and concurrent misses for the same token share one check.
+    The check is a task of its own that every caller shields, so a caller
+    being cancelled never leaves the others waiting on it.
+    """
+    key = _token_key(token_value)
+    decoded = _token_cache.get(key)
+    if decoded is not None:
+        return decoded
+
+    check = _token_inflight.get(key)
+    if check is None:
+        check = asyncio.create_task(
+            asyncio.to_thread(firebase_auth.verify_id_token, token_value, clock_skew_seconds=60)
+        )
+        _token_inflight[key] = check
+        check.add_done_callback(lambda done: _settle_token(key, done))
+    return await asyncio.shield(check)
+
+async def get_current_user(request: Request):
+    token = request.headers.get("Authorization")
+    if not token or not token.startswith("Bearer "):
+        log.debug("Missing or invalid token format")
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+
+    try:
+        token_value = token.split(" ")[1]
+        return await verify_token(token_value)
+    except firebase_auth.InvalidIdTokenError as e:
+        log.info("Invalid token: %s", e)
+        raise HTTPException(status_code=401, detail=f"Invalid Firebase token: {str(e)}")
+    except Exception as e:
+        # Logged with its traceback by log_server_errors.
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+async def require_admin(request: Request):
+    user = await get_current_user(request)
+    if user.get("uid") not in ADMIN_UIDS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
\ No newline at end of file
@@ -0,0 +1,61 @@
+import os
+from typing import Dict, Iterable, List
+from cachetools import TTLCache
+from db import db
+
+# Posts, updates and comments store only the author's firebase_uid. Names and
+# avatars are filled in at read time from this directory, so a rename shows up
+# everywhere at once and writes never have to look the author up.
+
+AUTHOR_TTL_SECONDS = int(os.getenv("AUTHOR_TTL_SECONDS", "300"))
+
+_directory = TTLCache(maxsize=int(os.getenv("AUTHOR_CACHE_SIZE", "50000")), ttl=AUTHOR_TTL_SECONDS)
+
+# Bumped on every local invalidation so cached responses can tell a rename happened.
+_version = 0
+
+AUTHOR_PROJECTION = {"_id": 0, "firebase_uid": 1, "username": 1, "email": 1, "imageUrl": 1}
+
+def _entry(user: dict) -> dict:
+    return {
+        "username": user.get("username") or user.get("email"),
+        "imageUrl": user.get("imageUrl"),
+    }
+
+def invalidate_author(firebase_uid: str):
+    global _version
+    _directory.pop(firebase_uid, None)
+    _version += 1
+
+def directory_version() -> int:
+    return _version
+
+async def get_authors(uids: Iterable[str]) -> Dict[str, dict]:
+    """Directory entries for uids, fetching every uncached one in a single $in query."""
+    found, missing = {}, []
+    for uid in set(uids):
+        entry = _directory.get(uid)
+        if entry is None:
+            missing.append(uid)
+        else:
+            found[uid] = entry
+    if missing:
+        users = await db.Users.find({"firebase_uid": {"$in": missing}}, AUTHOR_PROJECTION).to_list(len(missing))
+        for user in users:
+            entry = _entry(user)
+            _directory[user["firebase_uid"]] = entry
+            found[user["firebase_uid"]] = entry
+    return found
+
+async def hydrate_authors(docs: List[dict], field: str = "user_id") -> List[dict]:
+    authors = await get_authors(doc[field] for doc in docs if doc.get(field))
+    for doc in docs:
+        author = authors.get(doc.get(field))
+        if author is not None:
+            doc["username"] = author["username"]
+            doc["imageUrl"] = author["imageUrl"]
+        else:
+            # Deleted or never-registered authors keep whatever was stored.
+            doc.setdefault("username", None)
+            doc.setdefault("imageUrl", None)
+    return docs
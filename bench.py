@@ -0,0 +1,342 @@
+"""Load-test and benchmark harness for the API and chat.
+
+Runs the FastAPI app from main.py in-process against a real Mongo
+(--mongo-uri) or an in-memory stand-in (--in-memory, needs mongomock-motor),
+seeds it, and reports p50/p99 latency and throughput per scenario:
+
+    python bench.py --in-memory --users 200 --posts 2000 --out bench.json
+
+Results are written as JSON tagged with the current commit so runs can be
+compared across commits.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+SCENARIOS = ["feed", "blog", "news", "like", "comment", "comments", "profile", "profile_posts", "chat", "serialize", "search", "home"]
+# mongomock has no $text support.
+NEEDS_MONGO = {"search"}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default=None, help="benchmark against this Mongo (a throwaway database is used)")
+    parser.add_argument("--in-memory", action="store_true", help="use mongomock-motor instead of a Mongo server")
+    parser.add_argument("--database", default="internetButFun_bench")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--likes", type=int, default=20, help="likes per post")
+    parser.add_argument("--comments", type=int, default=5, help="comments per post")
+    parser.add_argument("--requests", type=int, default=500, help="requests per HTTP scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--chat-clients", type=int, default=50)
+    parser.add_argument("--chat-messages", type=int, default=100)
+    parser.add_argument("--chat-format", choices=["json", "msgpack"], default="json")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=None, help="write JSON results here (default: stdout)")
+    return parser.parse_args()
+
+def connect_database(args):
+    """Point db.db at the benchmark database before any router imports it."""
+    import db as db_module
+    if args.in_memory:
+        from mongomock_motor import AsyncMongoMockClient
+        import mongomock.collection
+        # pymongo's UpdateOne passes a sort option mongomock's bulk builder does not know.
+        add_update = mongomock.collection.BulkOperationBuilder.add_update
+        mongomock.collection.BulkOperationBuilder.add_update = lambda self, *a, sort=None, **kw: add_update(self, *a, **kw)
+        db_module.client = AsyncMongoMockClient()
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        db_module.client = AsyncIOMotorClient(args.mongo_uri or db_module.MONGO_URL)
+    db_module.db = db_module.client[args.database]
+    return db_module.db
+
+def bench_token(i: int) -> str:
+    return f"bench-token-{i}"
+
+def bench_claims(i: int) -> dict:
+    return {"uid": f"bench-u{i}", "email": f"bench{i}@example.com", "exp": time.time() + 24 * 3600}
+
+def stub_auth(app_module, main_module, users: int):
+    """Skip Firebase: REST auth resolves the bench token directly, chat hits a primed token cache."""
+    from fastapi import HTTPException, Request
+    claims = {bench_token(i): bench_claims(i) for i in range(users)}
+
+    async def bench_user(request: Request):
+        token = request.headers.get("Authorization", "").replace("Bearer ", "")
+        if token not in claims:
+            raise HTTPException(status_code=401, detail="Unknown bench token")
+        return claims[token]
+
+    main_module.app.dependency_overrides[app_module.get_current_user] = bench_user
+    for token, decoded in claims.items():
+        app_module._token_cache[app_module._token_key(token)] = decoded
+
+async def seed(db, args):
+    rng = random.Random(args.seed)
+    for name in ("Users", "Posts", "Updates", "News", "Comments", "Messages", "Timelines"):
+        await db[name].delete_many({})
+
+    await db.Users.insert_many([{
+        "firebase_uid": f"bench-u{i}",
+        "email": f"bench{i}@example.com",
+        "username": f"user{i}",
+        "aboutyou": "benchmark user",
+        "likes": ["music", "films"],
+        "interest_tags": ["films", "music"],
+        "profile_complete": True,
+        "createdAt": datetime.utcnow(),
+    } for i in range(args.users)])
+
+    base = datetime.utcnow() - timedelta(days=30)
+    for collection in (db.Posts, db.Updates):
+        docs = []
+        for i in range(args.posts):
+            likes = [f"bench-u{u}" for u in rng.sample(range(args.users), min(args.likes, args.users))]
+            docs.append({
+                "user_id": f"bench-u{rng.randrange(args.users)}",
+                "username": "bench",
+                "title": f"Post {i} about {rng.choice(['music', 'films', 'food', 'games'])}",
+                "content": "lorem ipsum " * 20,
+                "image_url": "",
+                "created_at": base + timedelta(seconds=i * 60),
+                "likes": likes,
+                "saves": [],
+                "like_count": len(likes),
+                "save_count": 0,
+                "comment_count": args.comments,
+            })
+        result = await collection.insert_many(docs)
+        parent_type = "post" if collection.name == "Posts" else "update"
+        comments = [{
+            "parent_id": parent_id,
+            "parent_type": parent_type,
+            "user_id": f"bench-u{rng.randrange(args.users)}",
+            "username": "bench",
+            "content": "nice",
+            "timestamp": base + timedelta(seconds=j),
+        } for parent_id in result.inserted_ids for j in range(args.comments)]
+        if comments:
+            await db.Comments.insert_many(comments)
+
+    await db.News.insert_many([{
+        "title": f"News {i}", "content": "news " * 20, "url": "", "author": "bench",
+        "date": base + timedelta(seconds=i * 60),
+    } for i in range(args.posts)])
+
+    post_ids = [str(p["_id"]) for p in await db.Posts.find({}, {"_id": 1}).to_list(None)]
+    if "home" in args.scenarios:
+        # Posts were inserted directly, so run the fan-out the API would have queued.
+        from timeline import fan_out_post
+        for post_id in post_ids:
+            await fan_out_post({"post_id": post_id})
+    return {"post_ids": post_ids}
+
+def summarize(latencies: list, elapsed: float, errors: int) -> dict:
+    latencies = sorted(latencies)
+    count = len(latencies)
+    if not count:
+        return {"count": 0, "errors": errors}
+    return {
+        "count": count,
+        "errors": errors,
+        "p50_ms": round(latencies[count // 2] * 1000, 3),
+        "p99_ms": round(latencies[min(count - 1, int(count * 0.99))] * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "throughput_rps": round(count / elapsed, 1) if elapsed else None,
+    }
+
+async def run_http(client, make_request, total: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for n in counter:
+            method, url, kwargs = make_request(n)
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+def http_scenarios(args, seeded):
+    rng = random.Random(args.seed)
+    post_ids = seeded["post_ids"]
+
+    def auth(n):
+        return {"headers": {"Authorization": f"Bearer {bench_token(n % args.users)}"}}
+
+    def like(n):
+        action = "like" if (n // len(post_ids)) % 2 == 0 else "unlike"
+        return "POST", f"/posts/{post_ids[n % len(post_ids)]}/{action}", auth(n)
+
+    return {
+        "feed": lambda n: ("GET", "/posts", auth(n)),
+        "home": lambda n: ("GET", "/home", auth(n)),
+        "blog": lambda n: ("GET", "/blog", auth(n)),
+        "news": lambda n: ("GET", "/news", auth(n)),
+        "like": like,
+        "comment": lambda n: ("POST", f"/posts/{rng.choice(post_ids)}/comment", {**auth(n), "json": {"content": f"bench {n}"}}),
+        "comments": lambda n: ("GET", f"/posts/{rng.choice(post_ids)}/comments", auth(n)),
+        "profile": lambda n: ("GET", f"/profile/user{rng.randrange(args.users)}", auth(n)),
+        "profile_posts": lambda n: ("GET", f"/profile/user{rng.randrange(args.users)}/posts", auth(n)),
+        "search": lambda n: ("GET", f"/search?q={rng.choice(['lorem', 'post', 'news ipsum'])}", auth(n)),
+    }
+
+async def run_serialization(db, args) -> dict:
+    """CPU to render one 100-post feed: jsonable_encoder + json vs response model + orjson."""
+    from typing import List
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from pydantic import TypeAdapter
+    from engagement import FeedItem, fetch_feed
+    from pagination import keyset_sort
+    from serialization import FastJSONResponse
+
+    docs = await fetch_feed(db.Posts, {}, sort=keyset_sort("created_at"), limit=100, viewer_uid=bench_claims(0)["uid"])
+    legacy_docs = [{**doc, "_id": str(doc["_id"])} for doc in docs]
+    adapter = TypeAdapter(List[FeedItem])
+
+    paths = {
+        "jsonable_encoder_json": lambda: JSONResponse(jsonable_encoder(legacy_docs)),
+        "response_model_orjson": lambda: FastJSONResponse(
+            adapter.dump_python(adapter.validate_python(docs), mode="json", by_alias=True)
+        ),
+    }
+    result = {"documents": len(docs)}
+    for name, render in paths.items():
+        timings = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            render()
+            timings.append(time.perf_counter() - started)
+        result[name] = summarize(timings, sum(timings), 0)
+    result["speedup"] = round(result["jsonable_encoder_json"]["mean_ms"] / result["response_model_orjson"]["mean_ms"], 2)
+    return result
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def run_chat(app, args) -> dict:
+    """N clients connected; each message is timed until every client has received it."""
+    import uvicorn
+    import websockets
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    clients = min(args.chat_clients, args.users)
+    binary = args.chat_format == "msgpack"
+    if binary:
+        import msgpack
+        encode = msgpack.packb
+    else:
+        encode = json.dumps
+    sockets = []
+    try:
+        for i in range(clients):
+            ws = await websockets.connect(f"ws://127.0.0.1:{port}/chat?token={bench_token(i)}", max_size=None,
+                                          subprotocols=["msgpack"] if binary else None)
+            await ws.recv()  # history frame
+            sockets.append(ws)
+
+        latencies = []
+        started = time.perf_counter()
+        for n in range(args.chat_messages):
+            sent = time.perf_counter()
+            await sockets[n % clients].send(encode({"type": "message", "content": f"bench {n}"}))
+            await asyncio.gather(*(ws.recv() for ws in sockets))
+            latencies.append(time.perf_counter() - sent)
+        elapsed = time.perf_counter() - started
+        result = summarize(latencies, elapsed, 0)
+        result["clients"] = clients
+        result["format"] = args.chat_format
+        result["deliveries_per_s"] = round(len(latencies) * clients / elapsed, 1)
+        return result
+    finally:
+        for ws in sockets:
+            await ws.close()
+        server.should_exit = True
+        await serve_task
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), text=True).strip()
+    except Exception:
+        return None
+
+async def main():
+    args = parse_args()
+    db = connect_database(args)
+
+    import app as app_module
+    import main as main_module
+    import httpx
+
+    # Access lines and library INFO records would be timed along with every request.
+    logging.getLogger().setLevel(logging.WARNING)
+
+    stub_auth(app_module, main_module, args.users)
+    seeded = await seed(db, args)
+    await main_module.app.router.startup()
+
+    wanted = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    if args.in_memory:
+        wanted = [s for s in wanted if s not in NEEDS_MONGO]
+    results = {}
+    try:
+        # Unhandled app errors come back as 500s and are counted, not raised.
+        transport = httpx.ASGITransport(app=main_module.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            scenarios = http_scenarios(args, seeded)
+            for name in wanted:
+                if name in scenarios:
+                    results[name] = await run_http(client, scenarios[name], args.requests, args.concurrency)
+                    print(f"{name}: {results[name]}", file=sys.stderr)
+        if "serialize" in wanted:
+            results["serialize"] = await run_serialization(db, args)
+            print(f"serialize: {results['serialize']}", file=sys.stderr)
+        if "chat" in wanted:
+            results["chat"] = await run_chat(main_module.app, args)
+            print(f"chat: {results['chat']}", file=sys.stderr)
+    finally:
+        await main_module.app.router.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "backend": "in-memory" if args.in_memory else "mongo",
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "mongo_uri")},
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,115 +1,274 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import Dict, Optional
-from pydantic import BaseModel
-from datetime import datetime
-import json
-from app import get_current_user, db
-from firebase_admin import auth as firebase_auth
-
-def create_chat_router(db):
-    router = APIRouter()
-
-    class ChatMessage(BaseModel):
-        content: str
-        sender_id: str
-        username: str
-        timestamp: datetime
-        imageUrl: Optional[str] = None
-
-    class ConnectionManager:
-        def __init__(self):
-            self.active_connections: Dict[str, WebSocket] = {}
-
-        async def connect(self, websocket: WebSocket, user_id: str):
-            await websocket.accept()
-            self.active_connections[user_id] = websocket
-
-        def disconnect(self, user_id: str):
-            self.active_connections.pop(user_id, None)
-
-        async def broadcast(self, message: dict):
-            for connection in self.active_connections.values():
-                await connection.send_json(message)
-
-    manager = ConnectionManager()
-
-    @router.websocket("/chat")
-    async def websocket_chat(websocket: WebSocket, token: str):
-        try:
-            token = token.replace("Bearer ", "")
-            user = firebase_auth.verify_id_token(token, clock_skew_seconds=60)
-            user_id = user["uid"]
-            email = user.get("email", "unknown")
-            print(f"WebSocket: Verifying user {email} with UID {user_id}")
-            
-            user_data = await db.Users.find_one({"firebase_uid": user_id})
-            if not user_data:
-                print(f"User {email} not found, auto-registering")
-                user_data = {
-                    "firebase_uid": user_id,
-                    "email": email,
-                    "profile_complete": False,
-                    "createdAt": datetime.utcnow()
-                }
-                await db.Users.insert_one(user_data)
-                username = "Anonymous"
-                image_url = None
-            else:
-                username = user_data.get("username", "Anonymous")
-                image_url = user_data.get("imageUrl", None)
-            print(f"WebSocket: User {username} (UID: {user_id}) authenticated")
-        
-        except Exception as e:
-            print(f"WebSocket: Token verification failed: {str(e)}")
-            await websocket.close(code=4001, reason=f"Invalid token: {str(e)}")
-            return
-
-        await manager.connect(websocket, user_id)
-        try:
-            recent_messages = await db.Messages.find().sort("timestamp", -1).limit(50).to_list(50)
-            recent_messages.reverse()
-            for msg in recent_messages:
-                await websocket.send_json({
-                    "type": "message",
-                    "content": msg["content"],
-                    "sender_id": msg["sender_id"],
-                    "username": msg["username"],
-                    "timestamp": msg["timestamp"].isoformat(),
-                    "imageUrl": msg.get("imageUrl", None)
-                })
-
-            while True:
-                data = await websocket.receive_json()
-                if data.get("type") != "message":
-                    continue
-
-                content = data.get("content", "").strip()
-                if not content:
-                    continue
-
-                message = {
-                    "content": content,
-                    "sender_id": user_id,
-                    "username": username,
-                    "timestamp": datetime.utcnow(),
-                    "imageUrl": image_url
-                }
-                await db.Messages.insert_one(message)
-
-                await manager.broadcast({
-                    "type": "message",
-                    "content": content,
-                    "sender_id": user_id,
-                    "username": username,
-                    "timestamp": message["timestamp"].isoformat(),
-                    "imageUrl": image_url
-                })
-
-        except WebSocketDisconnect:
-            manager.disconnect(user_id)
-        except Exception as e:
-            print(f"WebSocket: Error for user {username}: {str(e)}")
-            manager.disconnect(user_id)
-            await websocket.close(code=4000, reason=str(e))
-
+from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
+from typing import Dict, Optional
+from pydantic import BaseModel
+from datetime import datetime, timezone
+from collections import deque
+import asyncio
+import json
+import logging
+import os
+import time
+import msgpack
+from pymongo import DESCENDING
+from pymongo.errors import DuplicateKeyError
+from app import get_current_user, require_admin, verify_token, db
+from indexes import register_index
+from pubsub import backend_from_env
+from writebehind import WriteBehindQueue
+from serialization import pack
+from metrics import Counter, Gauge, Histogram
+
+log = logging.getLogger(__name__)
+
+register_index("Messages", [("timestamp", DESCENDING)])
+
+CHAT_SEND_QUEUE_SIZE = int(os.getenv("CHAT_SEND_QUEUE_SIZE", "100"))
+# "drop_oldest" skips ahead for clients that fall behind, "disconnect" closes them.
+CHAT_SLOW_CONSUMER_POLICY = os.getenv("CHAT_SLOW_CONSUMER_POLICY", "drop_oldest")
+CHAT_HISTORY_SIZE = int(os.getenv("CHAT_HISTORY_SIZE", "50"))
+# Clients offering this subprotocol get binary MessagePack frames instead of JSON text.
+MSGPACK_SUBPROTOCOL = "msgpack"
+
+CHAT_CONNECTIONS = Gauge("chat_active_connections", "Open chat WebSocket connections.")
+CHAT_MESSAGES = Counter("chat_messages_total", "Chat messages delivered to this worker's clients.")
+CHAT_BROADCAST_LATENCY = Histogram("chat_broadcast_duration_seconds", "Time to fan one message out to every local client.")
+
+def _parse_since(since: Optional[str]):
+    try:
+        cutoff = datetime.fromisoformat(since)
+    except (TypeError, ValueError):
+        return None
+    if cutoff.tzinfo is not None:
+        cutoff = cutoff.astimezone(timezone.utc).replace(tzinfo=None)
+    return cutoff
+
+def encode_frame(message: dict, binary: bool):
+    return pack(message) if binary else json.dumps(message)
+
+async def receive_frame(websocket: WebSocket):
+    """Next client frame, decoded from JSON text or MessagePack bytes alike."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    if message.get("bytes") is not None:
+        return msgpack.unpackb(message["bytes"])
+    return json.loads(message["text"])
+
+def create_chat_router(db):
+    router = APIRouter()
+
+    class ChatMessage(BaseModel):
+        content: str
+        sender_id: str
+        username: str
+        timestamp: datetime
+        imageUrl: Optional[str] = None
+
+    class ClientConnection:
+        """One socket plus a bounded outbound queue drained by its own writer task.
+
+        Broadcasting only enqueues, so a slow or dead client never delays the
+        others; what happens when its queue fills up is the slow-consumer policy.
+        """
+
+        def __init__(self, websocket: WebSocket, user_id: str, on_close, binary: bool = False):
+            self.websocket = websocket
+            self.user_id = user_id
+            self.binary = binary
+            self.queue: asyncio.Queue = asyncio.Queue(maxsize=CHAT_SEND_QUEUE_SIZE)
+            self.on_close = on_close
+            self.task = asyncio.create_task(self._writer())
+
+        def send(self, message: dict) -> bool:
+            return self.enqueue(encode_frame(message, self.binary))
+
+        def enqueue(self, frame) -> bool:
+            try:
+                self.queue.put_nowait(frame)
+                return True
+            except asyncio.QueueFull:
+                if CHAT_SLOW_CONSUMER_POLICY == "disconnect":
+                    return False
+                self.queue.get_nowait()
+                self.queue.put_nowait(frame)
+                return True
+
+        async def _writer(self):
+            try:
+                while True:
+                    frame = await self.queue.get()
+                    if self.binary:
+                        await self.websocket.send_bytes(frame)
+                    else:
+                        await self.websocket.send_text(frame)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("WebSocket: dropping %s after send failure: %s", self.user_id, e)
+                self.on_close(self)
+
+        async def close(self, code: int = 1000, reason: str = ""):
+            self.task.cancel()
+            try:
+                await self.websocket.close(code=code, reason=reason)
+            except Exception:
+                pass
+
+    class ConnectionManager:
+        def __init__(self):
+            self.active_connections: Dict[str, ClientConnection] = {}
+
+        async def connect(self, websocket: WebSocket, user_id: str) -> ClientConnection:
+            binary = MSGPACK_SUBPROTOCOL in websocket.scope.get("subprotocols", [])
+            await websocket.accept(subprotocol=MSGPACK_SUBPROTOCOL if binary else None)
+            previous = self.active_connections.get(user_id)
+            if previous is not None:
+                previous.task.cancel()
+            connection = ClientConnection(websocket, user_id, self._remove, binary=binary)
+            self.active_connections[user_id] = connection
+            return connection
+
+        def _remove(self, connection: ClientConnection):
+            if self.active_connections.get(connection.user_id) is connection:
+                del self.active_connections[connection.user_id]
+
+        def disconnect(self, user_id: str, connection: Optional[ClientConnection] = None):
+            current = self.active_connections.get(user_id)
+            if current is None or (connection is not None and current is not connection):
+                return
+            del self.active_connections[user_id]
+            current.task.cancel()
+
+        async def broadcast(self, message: dict):
+            # Encoded at most once per format, however many clients share it.
+            frames = {}
+            for connection in list(self.active_connections.values()):
+                frame = frames.get(connection.binary)
+                if frame is None:
+                    frame = frames[connection.binary] = encode_frame(message, connection.binary)
+                if not connection.enqueue(frame):
+                    self._remove(connection)
+                    asyncio.create_task(connection.close(code=1013, reason="Too slow to keep up"))
+
+    manager = ConnectionManager()
+    CHAT_CONNECTIONS.function = lambda: len(manager.active_connections)
+    backend = backend_from_env(db)
+    # Messages are persisted in batches off the send path.
+    message_writer = WriteBehindQueue(db.Messages)
+    # Recent messages as sent to clients, so connects and reconnects never query Mongo.
+    history = deque(maxlen=CHAT_HISTORY_SIZE)
+
+    def history_since(since: Optional[str] = None):
+        cutoff = _parse_since(since)
+        if cutoff is None:
+            return list(history)
+        return [m for m in history if datetime.fromisoformat(m["timestamp"]) > cutoff]
+
+    async def deliver(message: dict):
+        history.append(message)
+        started = time.perf_counter()
+        await manager.broadcast(message)
+        CHAT_BROADCAST_LATENCY.observe(value=time.perf_counter() - started)
+        CHAT_MESSAGES.inc()
+
+    @router.on_event("startup")
+    async def start_broadcast_backend():
+        recent_messages = await db.Messages.find().sort("timestamp", -1).limit(CHAT_HISTORY_SIZE).to_list(CHAT_HISTORY_SIZE)
+        history.clear()
+        for msg in reversed(recent_messages):
+            history.append({
+                "type": "message",
+                "content": msg["content"],
+                "sender_id": msg["sender_id"],
+                "username": msg["username"],
+                "timestamp": msg["timestamp"].isoformat(),
+                "imageUrl": msg.get("imageUrl", None)
+            })
+        await message_writer.start()
+        await backend.start(deliver)
+
+    @router.on_event("shutdown")
+    async def stop_broadcast_backend():
+        await backend.stop()
+        await message_writer.stop()
+
+    @router.get("/debug/chat-writes")
+    async def get_chat_write_metrics(user=Depends(require_admin)):
+        return message_writer.metrics()
+
+    @router.websocket("/chat")
+    async def websocket_chat(websocket: WebSocket, token: str, since: Optional[str] = None):
+        try:
+            token = token.replace("Bearer ", "")
+            user = await verify_token(token)
+            user_id = user["uid"]
+            email = user.get("email", "unknown")
+
+            user_data = await db.Users.find_one({"firebase_uid": user_id})
+            if not user_data:
+                log.info("WebSocket: auto-registering %s", user_id)
+                user_data = {
+                    "firebase_uid": user_id,
+                    "email": email,
+                    "profile_complete": False,
+                    "createdAt": datetime.utcnow()
+                }
+                try:
+                    await db.Users.insert_one(user_data)
+                except DuplicateKeyError:
+                    pass
+                username = "Anonymous"
+                image_url = None
+            else:
+                username = user_data.get("username", "Anonymous")
+                image_url = user_data.get("imageUrl", None)
+            log.debug("WebSocket: %s authenticated", user_id)
+        
+        except Exception as e:
+            log.info("WebSocket: token verification failed: %s", e)
+            await websocket.close(code=4001, reason=f"Invalid token: {str(e)}")
+            return
+
+        connection = await manager.connect(websocket, user_id)
+        try:
+            connection.send({"type": "history", "messages": history_since(since)})
+
+            while True:
+                data = await receive_frame(websocket)
+                if not isinstance(data, dict):
+                    continue
+                if data.get("type") == "sync":
+                    connection.send({"type": "history", "messages": history_since(data.get("since"))})
+                    continue
+                if data.get("type") != "message":
+                    continue
+
+                content = data.get("content", "").strip()
+                if not content:
+                    continue
+
+                message = {
+                    "content": content,
+                    "sender_id": user_id,
+                    "username": username,
+                    "timestamp": datetime.utcnow(),
+                    "imageUrl": image_url
+                }
+                await backend.publish({
+                    "type": "message",
+                    "content": content,
+                    "sender_id": user_id,
+                    "username": username,
+                    "timestamp": message["timestamp"].isoformat(),
+                    "imageUrl": image_url
+                })
+                await message_writer.put(message)
+
+        except WebSocketDisconnect:
+            manager.disconnect(user_id, connection)
+        except Exception as e:
+            log.exception("WebSocket: error for %s: %s", user_id, e)
+            manager.disconnect(user_id, connection)
+            await websocket.close(code=4000, reason=str(e))
+
     return router
\ No newline at end of file
@@ -0,0 +1,61 @@
+from bson import ObjectId
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel
+from pymongo import ASCENDING, DESCENDING
+from db import db
+from authors import hydrate_authors
+from feedcache import feed_cache
+from indexes import register_index
+from pagination import clamp_limit, keyset_sort, next_cursor, page_query
+from serialization import ObjectIdStr
+
+# Comments live in their own collection, indexed by (parent_id, timestamp),
+# so parent documents stay small and reads scale with the page size.
+
+register_index("Comments", [("parent_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)])
+
+class CommentOut(BaseModel):
+    comment_id: Optional[ObjectIdStr] = None
+    user_id: Optional[str] = None
+    content: str
+    timestamp: Optional[datetime] = None
+    username: Optional[str] = None
+    imageUrl: Optional[str] = None
+
+class CommentPage(BaseModel):
+    comments: List[CommentOut]
+    next_cursor: Optional[str] = None
+
+class CommentCreated(BaseModel):
+    message: str
+    comment: CommentOut
+
+async def add_comment(parent_collection, parent_type: str, parent_id: ObjectId, user_id: str, content: str):
+    comment_id = ObjectId()
+    comment_data = {
+        "_id": comment_id,
+        "parent_id": parent_id,
+        "parent_type": parent_type,
+        "comment_id": str(comment_id),
+        "user_id": user_id,
+        "content": content,
+        "timestamp": datetime.utcnow()
+    }
+    await db.Comments.insert_one(comment_data)
+    await parent_collection.update_one({"_id": parent_id}, {"$inc": {"comment_count": 1}})
+    feed_cache.invalidate(parent_collection.name, hard=False)
+    await hydrate_authors([comment_data])
+    return comment_data
+
+async def list_comments(parent_id: ObjectId, cursor: Optional[str] = None, limit: int = 20):
+    """Newest-first page of comments plus the cursor for the next page."""
+    limit = clamp_limit(limit)
+    query = page_query({"parent_id": parent_id}, "timestamp", cursor)
+    comments = await db.Comments.find(query).sort(keyset_sort("timestamp")).limit(limit).to_list(limit)
+    cursor_out = next_cursor(comments, "timestamp", limit)
+    await hydrate_authors(comments)
+    return {"comments": comments, "next_cursor": cursor_out}
+
+async def delete_comments(parent_id: ObjectId):
+    await db.Comments.delete_many({"parent_id": parent_id})
@@ -1,6 +1,28 @@
-from motor.motor_asyncio import AsyncIOMotorClient
-import os
-
-MONGO_URL = os.getenv("MONGODB_URI", "mongodb://localhost:27017")  
-client = AsyncIOMotorClient(MONGO_URL)
-db = client["internetButFun_db"]
\ No newline at end of file
+from motor.motor_asyncio import AsyncIOMotorClient
+from metrics import command_metrics
+from slowqueries import slow_query_recorder
+import os
+
+MONGO_URL = os.getenv("MONGODB_URI", "mongodb://localhost:27017")  
+client = AsyncIOMotorClient(MONGO_URL, event_listeners=[command_metrics, slow_query_recorder])
+db = client["internetButFun_db"]
+
+_transactions_supported = None
+
+async def supports_transactions():
+    """Multi-document transactions need a replica set or a sharded cluster."""
+    global _transactions_supported
+    if _transactions_supported is None:
+        try:
+            hello = await client.admin.command("hello")
+            _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        except Exception:
+            _transactions_supported = False
+    return _transactions_supported
+
+async def run_in_transaction(callback):
+    """Run callback(session) in a transaction, or with no session on a standalone server."""
+    if not await supports_transactions():
+        return await callback(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(callback)
@@ -0,0 +1,305 @@
+import re
+from fastapi import APIRouter, Depends, HTTPException
+from bson import ObjectId
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import List, Literal, Optional
+from pymongo import ASCENDING, DESCENDING, DeleteOne, ReturnDocument, UpdateOne
+from app import get_current_user
+from db import db, run_in_transaction
+from authors import hydrate_authors
+from serialization import ObjectIdStr
+from feedcache import feed_cache
+from indexes import register_index
+from pagination import keyset_sort, next_cursor, page_query
+
+router = APIRouter()
+
+# Who liked or saved what lives in Edges, one document per (user, kind,
+# target), where kind is liked_posts, saved_posts, liked_updates or
+# saved_updates. Users documents no longer grow with every like, and
+# "my liked/saved" lists page by when the edge was created.
+register_index("Edges", [("user_id", ASCENDING), ("kind", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+register_index("Edges", [("user_id", ASCENDING), ("kind", ASCENDING), ("target_id", ASCENDING)], unique=True)
+register_index("Edges", [("target_id", ASCENDING)])
+
+# Engagement arrays stay on the document for membership checks but never leave Mongo.
+HIDDEN_FIELDS = {"likes": 0, "saves": 0, "comments": 0}
+
+COUNTERS = {
+    "like_count": "likes",
+    "save_count": "saves",
+    "comment_count": "comments",
+}
+
+class FeedItem(BaseModel):
+    id: ObjectIdStr = Field(alias="_id")
+    user_id: Optional[str] = None
+    title: Optional[str] = None
+    content: Optional[str] = None
+    image_url: Optional[str] = None
+    created_at: Optional[datetime] = None
+    like_count: int = 0
+    save_count: int = 0
+    comment_count: int = 0
+    liked: Optional[bool] = None
+    saved: Optional[bool] = None
+    username: Optional[str] = None
+    imageUrl: Optional[str] = None
+
+def _counter(field: str, array: str):
+    # Documents written before the counters existed fall back to the array size.
+    return {"$ifNull": [f"${field}", {"$size": {"$ifNull": [f"${array}", []]}}]}
+
+def _member(uid: str, array: str):
+    return {"$in": [uid, {"$ifNull": [f"${array}", []]}]}
+
+def feed_pipeline(query: dict, sort=None, limit: Optional[int] = None, skip: int = 0, viewer_uid: Optional[str] = None):
+    """Aggregation that returns documents with counters and, for a viewer, liked/saved flags."""
+    pipeline = [{"$match": query}]
+    if sort:
+        pipeline.append({"$sort": dict(sort)})
+    if skip:
+        pipeline.append({"$skip": skip})
+    if limit:
+        pipeline.append({"$limit": limit})
+    return pipeline + feed_stages(viewer_uid)
+
+def feed_stages(viewer_uid: Optional[str] = None):
+    """The stages that turn selected documents into feed items."""
+    fields = {field: _counter(field, array) for field, array in COUNTERS.items()}
+    if viewer_uid is not None:
+        fields["liked"] = _member(viewer_uid, "likes")
+        fields["saved"] = _member(viewer_uid, "saves")
+    return [{"$addFields": fields}, {"$project": HIDDEN_FIELDS}]
+
+async def fetch_feed(collection, query: dict, sort=None, limit: int = 100, skip: int = 0,
+                     viewer_uid: Optional[str] = None, hydrate: bool = True):
+    pipeline = feed_pipeline(query, sort=sort, limit=limit, skip=skip, viewer_uid=viewer_uid)
+    docs = await collection.aggregate(pipeline).to_list(limit)
+    return await hydrate_authors(docs) if hydrate else docs
+
+async def viewer_flags(collection, docs: List[dict], viewer_uid: str):
+    """Copies of docs with the viewer's liked/saved flags, looked up in one small query."""
+    ids = [doc["_id"] for doc in docs]
+    flags = {}
+    if ids:
+        rows = await collection.aggregate([
+            {"$match": {"_id": {"$in": ids}, "$or": [{"likes": viewer_uid}, {"saves": viewer_uid}]}},
+            {"$project": {"liked": _member(viewer_uid, "likes"), "saved": _member(viewer_uid, "saves")}},
+        ]).to_list(len(ids))
+        flags = {row["_id"]: row for row in rows}
+    overlaid = []
+    for doc in docs:
+        row = flags.get(doc["_id"], {})
+        overlaid.append({**doc, "liked": row.get("liked", False), "saved": row.get("saved", False)})
+    return overlaid
+
+def flags_marker(docs: List[dict]) -> str:
+    """The viewer's flags on a page from viewer_flags, for its ETag.
+
+    They are read from Mongo on every request, so a like or unlike made
+    through another worker changes the tag even while this worker's cached
+    page has not moved.
+    """
+    return "".join(f"{int(doc['liked'])}{int(doc['saved'])}" for doc in docs)
+
+async def cached_page(collection, query: dict, sort=None, limit: int = 100, skip: int = 0):
+    """(tag, docs) for a viewer-independent page from the shared feed cache."""
+    params = (repr(query), repr(sort), limit, skip)
+    return await feed_cache.fetch(
+        collection.name, params,
+        lambda: fetch_feed(collection, query, sort=sort, limit=limit, skip=skip, hydrate=False)
+    )
+
+async def present_feed(collection, docs: List[dict], viewer_uid: Optional[str] = None):
+    """Copies of a cached page with the viewer's flags laid over it and authors hydrated.
+
+    Authors are hydrated at read time so renames are not held back by the cache.
+    """
+    if viewer_uid is None:
+        docs = [dict(doc) for doc in docs]
+    else:
+        docs = await viewer_flags(collection, docs, viewer_uid)
+    return await hydrate_authors(docs)
+
+# kind -> (array on the post/update, its counter, response flag)
+KINDS = {
+    "like": ("likes", "like_count", "liked"),
+    "save": ("saves", "save_count", "saved"),
+}
+
+COUNT_PROJECTION = {"like_count": 1, "save_count": 1}
+
+def _toggle_ops(doc_id, uid: str, kind: str, on: bool, user_field: str):
+    array, counter, _ = KINDS[kind]
+    edge = {"user_id": uid, "kind": user_field, "target_id": doc_id}
+    if on:
+        query = {"_id": doc_id, array: {"$ne": uid}}
+        update = {"$push": {array: uid}, "$inc": {counter: 1}}
+        edge_op = UpdateOne(edge, {"$setOnInsert": {"created_at": datetime.utcnow()}}, upsert=True)
+    else:
+        query = {"_id": doc_id, array: uid}
+        update = {"$pull": {array: uid}, "$inc": {counter: -1}}
+        edge_op = DeleteOne(edge)
+    return query, update, edge_op
+
+async def toggle_engagement(collection, doc_id, uid: str, kind: str, on: bool, user_field: str):
+    """Set or clear a like/save and return the fresh counts, or None if the document is gone.
+
+    The conditional filter makes the counter change and the membership change a
+    single atomic update that only applies when the state actually flips, so a
+    double tap never double-counts. The edge is written in the same
+    transaction when the deployment supports one.
+    """
+    flag = KINDS[kind][2]
+    query, update, edge_op = _toggle_ops(doc_id, uid, kind, on, user_field)
+
+    async def apply(session):
+        doc = await collection.find_one_and_update(
+            query, update, projection=COUNT_PROJECTION,
+            return_document=ReturnDocument.AFTER, session=session
+        )
+        if doc is None:
+            # Already in the requested state, or the document does not exist.
+            doc = await collection.find_one({"_id": doc_id}, COUNT_PROJECTION, session=session)
+            if doc is None:
+                return None
+        await db.Edges.bulk_write([edge_op], session=session)
+        return doc
+
+    doc = await run_in_transaction(apply)
+    if doc is None:
+        return None
+    feed_cache.invalidate(collection.name, hard=False)
+    return {
+        flag: on,
+        "like_count": doc.get("like_count", 0),
+        "save_count": doc.get("save_count", 0),
+    }
+
+async def fetch_engaged(collection, uid: str, kind: str, cursor: Optional[str] = None, limit: int = 100):
+    """Feed items the user has an edge of `kind` to, most recent edge first, plus the next cursor."""
+    edges = await db.Edges.find(
+        page_query({"user_id": uid, "kind": kind}, "created_at", cursor), {"target_id": 1, "created_at": 1}
+    ).sort(keyset_sort("created_at")).limit(limit).to_list(limit)
+    cursor_out = next_cursor(edges, "created_at", limit)
+    ids = [edge["target_id"] for edge in edges]
+    if not ids:
+        return [], cursor_out
+    docs = await fetch_feed(collection, {"_id": {"$in": ids}}, limit=len(ids), viewer_uid=uid)
+    position = {target_id: index for index, target_id in enumerate(ids)}
+    docs.sort(key=lambda doc: position[doc["_id"]])
+    return docs, cursor_out
+
+async def delete_edges(target_id: ObjectId):
+    await db.Edges.delete_many({"target_id": target_id})
+
+# target -> (collection name, user-side field prefix)
+TARGETS = {
+    "post": ("Posts", "posts"),
+    "update": ("Updates", "updates"),
+}
+
+ACTIONS = {
+    "like": ("like", True),
+    "unlike": ("like", False),
+    "save": ("save", True),
+    "unsave": ("save", False),
+}
+
+MAX_BATCH_OPERATIONS = 200
+
+class EngagementOperation(BaseModel):
+    target: Literal["post", "update"]
+    id: str
+    action: Literal["like", "unlike", "save", "unsave"]
+
+class EngagementBatch(BaseModel):
+    operations: List[EngagementOperation] = Field(max_length=MAX_BATCH_OPERATIONS)
+
+def normalize_id(value: str) -> Optional[str]:
+    """Canonical (lowercase hex) form of an ObjectId string, or None.
+
+    ObjectId.is_valid also accepts any 12-character string as raw bytes, so
+    only 24 hex digits count here.
+    """
+    if not re.fullmatch(r"[0-9a-fA-F]{24}", value):
+        return None
+    return str(ObjectId(value))
+
+def coalesce(operations: List[EngagementOperation], ids: List[Optional[str]]):
+    """Keep only the last operation per (target, id, like|save); earlier ones are superseded."""
+    latest = {}
+    for index, (op, doc_id) in enumerate(zip(operations, ids)):
+        if doc_id is None:
+            continue
+        kind, _ = ACTIONS[op.action]
+        latest[(op.target, doc_id, kind)] = index
+    return latest
+
+async def apply_engagements(uid: str, operations: List[EngagementOperation]):
+    ids = [normalize_id(op.id) for op in operations]
+    results = [{"target": op.target, "id": doc_id or op.id, "action": op.action} for op, doc_id in zip(operations, ids)]
+    for index, doc_id in enumerate(ids):
+        if doc_id is None:
+            results[index]["status"] = "invalid"
+    effective = coalesce(operations, ids)
+    kept = set(effective.values())
+    for index, result in enumerate(results):
+        if "status" not in result and index not in kept:
+            result["status"] = "coalesced"
+
+    async def apply(session):
+        edge_ops = []
+        for target, (collection_name, suffix) in TARGETS.items():
+            keys = [key for key in effective if key[0] == target]
+            if not keys:
+                continue
+            collection = db[collection_name]
+            doc_ops = []
+            pending_edge_ops = []
+            for key in keys:
+                _, doc_id, _ = key
+                kind, on = ACTIONS[operations[effective[key]].action]
+                field = f"{'liked' if kind == 'like' else 'saved'}_{suffix}"
+                query, update, edge_op = _toggle_ops(ObjectId(doc_id), uid, kind, on, field)
+                doc_ops.append(UpdateOne(query, update))
+                pending_edge_ops.append((doc_id, edge_op))
+            await collection.bulk_write(doc_ops, ordered=False, session=session)
+
+            target_ids = list({ObjectId(key[1]) for key in keys})
+            docs = await collection.find({"_id": {"$in": target_ids}}, COUNT_PROJECTION, session=session).to_list(len(target_ids))
+            counts = {str(doc["_id"]): doc for doc in docs}
+            for key in keys:
+                _, doc_id, kind = key
+                index = effective[key]
+                doc = counts.get(doc_id)
+                if doc is None:
+                    results[index]["status"] = "not_found"
+                    continue
+                _, on = ACTIONS[operations[index].action]
+                results[index].update({
+                    "status": "applied",
+                    KINDS[kind][2]: on,
+                    "like_count": doc.get("like_count", 0),
+                    "save_count": doc.get("save_count", 0),
+                })
+            edge_ops.extend(op for doc_id, op in pending_edge_ops if doc_id in counts)
+        if edge_ops:
+            await db.Edges.bulk_write(edge_ops, ordered=False, session=session)
+
+    await run_in_transaction(apply)
+    for target in {key[0] for key in effective}:
+        feed_cache.invalidate(TARGETS[target][0], hard=False)
+    return results
+
+@router.post("/engagements")
+async def batch_engagements(batch: EngagementBatch, user=Depends(get_current_user)):
+    try:
+        results = await apply_engagements(user["uid"], batch.operations)
+        return {"results": results}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to apply engagements: {str(e)}")
@@ -0,0 +1,47 @@
+import hashlib
+import uuid
+from typing import Optional
+from fastapi import Request, Response
+from authors import directory_version
+from serialization import response_format
+
+# Validators are built from version markers (feed cache versions, a profile's
+# updatedAt), never by hashing the response body. In-process markers are
+# prefixed with BOOT_ID so another worker, or this one after a restart, can
+# never answer 304 for a tag it did not hand out.
+
+BOOT_ID = uuid.uuid4().hex
+
+ETAG_HEADER = "ETag"
+# Responses depend on the caller's token: browsers may keep them but must revalidate.
+CACHE_CONTROL = "private, no-cache"
+
+def make_etag(*parts) -> str:
+    # JSON and MessagePack bodies are different representations and need different tags.
+    parts = (*parts, response_format.get())
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+def feed_etag(feed: str, tag: str, viewer_uid: Optional[str] = None, viewer_marker: str = "") -> str:
+    """Validator for a feed cache page, as seen by viewer_uid when the body depends on them.
+
+    viewer_marker must change whenever the viewer's overlay does (see flags_marker).
+    """
+    return make_etag(BOOT_ID, feed, tag, directory_version(), viewer_uid or "", viewer_marker)
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, so W/"x" matches "x".
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+def conditional(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Tag the response; return a bare 304 to send instead when the client already has it."""
+    response.headers[ETAG_HEADER] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=dict(response.headers))
+    return None
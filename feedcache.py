@@ -0,0 +1,105 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Tuple
+from cachetools import LRUCache
+
+# Viewer-independent feed pages (the same for everyone, without liked/saved),
+# cached per collection and query. Each collection has a version:
+#   - creating or deleting a document drops its cached pages outright, so the
+#     new post shows up on the very next read;
+#   - engagement (likes, saves, comments) only marks pages stale; they keep
+#     being served while a single background refresh reloads them.
+# Pages also go stale after FEED_CACHE_TTL seconds, which bounds how long
+# another worker's writes take to show up here.
+
+FEED_CACHE_TTL = float(os.getenv("FEED_CACHE_TTL", "10"))
+FEED_CACHE_STALE_TTL = float(os.getenv("FEED_CACHE_STALE_TTL", "60"))
+
+log = logging.getLogger(__name__)
+
+Loader = Callable[[], Awaitable[List[dict]]]
+
+class FeedCache:
+    def __init__(self, ttl: float = FEED_CACHE_TTL, stale_ttl: float = FEED_CACHE_STALE_TTL, maxsize: int = 512):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # feed -> [generation, version]; creates/deletes bump both, engagement only the version.
+        self.versions: Dict[str, list] = defaultdict(lambda: [0, 0])
+        self._entries = LRUCache(maxsize=maxsize)
+        self._loading: Dict[tuple, asyncio.Future] = {}
+        self._serials = itertools.count(1)
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0}
+
+    def invalidate(self, feed: str, hard: bool = True):
+        version = self.versions[feed]
+        version[1] += 1
+        if hard:
+            version[0] += 1
+
+    def metrics(self) -> dict:
+        return {**self.stats, "entries": len(self._entries), "loading": len(self._loading)}
+
+    async def get(self, feed: str, params: tuple, loader: Loader) -> List[dict]:
+        _, docs = await self.fetch(feed, params, loader)
+        return docs
+
+    async def fetch(self, feed: str, params: tuple, loader: Loader) -> Tuple[str, List[dict]]:
+        """The page and a tag that changes whenever the page or its feed version does."""
+        key = (feed, params)
+        generation, version = self.versions[feed]
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == generation:
+            _, entry_version, fetched_at, serial, docs = entry
+            age = time.monotonic() - fetched_at
+            if entry_version == version and age < self.ttl:
+                self.stats["hits"] += 1
+                return f"{generation}.{version}.{serial}", docs
+            if age < self.stale_ttl:
+                self.stats["stale_hits"] += 1
+                if (key, generation) not in self._loading:
+                    self.stats["refreshes"] += 1
+                    asyncio.create_task(self._refresh(key, loader))
+                return f"{generation}.{version}.{serial}", docs
+        self.stats["misses"] += 1
+        generation, version, serial, docs = await self._load(key, loader)
+        return f"{generation}.{version}.{serial}", docs
+
+    async def _refresh(self, key: tuple, loader: Loader):
+        try:
+            await self._load(key, loader)
+        except Exception as e:
+            log.warning("Feed cache: background refresh of %s failed: %s", key[0], e)
+
+    async def _load(self, key: tuple, loader: Loader) -> Tuple[int, int, int, List[dict]]:
+        # Concurrent misses for the same page share a single query. It runs as
+        # a task of its own, so a cancelled caller never strands the others.
+        # Loads are keyed by generation too: after a create or delete, a miss
+        # never joins a load that started before it.
+        generation, version = self.versions[key[0]]
+        inflight = (key, generation)
+        load = self._loading.get(inflight)
+        if load is None:
+            load = asyncio.create_task(self._run_loader(inflight, version, loader))
+            self._loading[inflight] = load
+            load.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return await asyncio.shield(load)
+
+    async def _run_loader(self, inflight: tuple, version: int, loader: Loader) -> Tuple[int, int, int, List[dict]]:
+        key, generation = inflight
+        try:
+            docs = await loader()
+            # A write that raced with the load leaves the entry behind the current
+            # version, and the tag says which version the page was loaded at.
+            serial = next(self._serials)
+            current = self._entries.get(key)
+            if current is None or current[:2] <= (generation, version):
+                self._entries[key] = (generation, version, time.monotonic(), serial, docs)
+            return generation, version, serial, docs
+        finally:
+            self._loading.pop(inflight, None)
+
+feed_cache = FeedCache()
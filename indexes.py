@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, List
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+# Each router declares the indexes its queries need at import time; main.py
+# applies the whole registry on startup. create_indexes is idempotent, so
+# restarting a worker only costs one round trip per collection.
+
+log = logging.getLogger(__name__)
+
+_registry: Dict[str, List[IndexModel]] = defaultdict(list)
+
+def register_index(collection: str, keys, **options):
+    _registry[collection].append(IndexModel(keys, **options))
+
+def declared_indexes():
+    return {name: list(models) for name, models in _registry.items()}
+
+async def ensure_indexes(db):
+    failures = {}
+    for name, models in _registry.items():
+        try:
+            await db[name].create_indexes(models)
+        except OperationFailure as e:
+            # A conflicting definition or duplicate data must not stop the app
+            # from starting; the report below surfaces it as missing.
+            failures[name] = str(e)
+            log.error("Index creation failed on %s: %s", name, e)
+            if any(model.document.get("unique") for model in models):
+                # Routes keep their own checks for this case, but races are open again.
+                log.error("Unique indexes on %s may be missing; fix the duplicates "
+                          "(e.g. python migrate.py dedupe-usernames) and restart", name)
+    return failures
+
+async def index_report(db):
+    """Declared indexes that do not exist yet, and existing ones with no recorded use."""
+    report = {}
+    for name, models in _registry.items():
+        existing = await db[name].index_information()
+        declared = {model.document["name"] for model in models}
+        try:
+            stats = await db[name].aggregate([{"$indexStats": {}}]).to_list(None)
+        except OperationFailure:
+            stats = []
+        unused = sorted(
+            s["name"] for s in stats
+            if s["name"] != "_id_" and s.get("accesses", {}).get("ops", 0) == 0
+        )
+        report[name] = {
+            "missing": sorted(declared - set(existing)),
+            "unused": unused,
+            "undeclared": sorted(set(existing) - declared - {"_id_"}),
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Check or apply the declared Mongo indexes")
+    parser.add_argument("--apply", action="store_true", help="create missing indexes before reporting")
+    args = parser.parse_args()
+
+    # Importing the app pulls in every router, which fills the registry of the
+    # importable `indexes` module (not this __main__ copy).
+    import main as app_main
+    import indexes
+
+    async def run():
+        if args.apply:
+            await indexes.ensure_indexes(app_main.db)
+        report = await indexes.index_report(app_main.db)
+        for name, entry in sorted(report.items()):
+            print(f"{name}: missing={entry['missing']} unused={entry['unused']} undeclared={entry['undeclared']}")
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
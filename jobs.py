@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from db import db
+from indexes import register_index
+
+# A small persistent job queue: jobs are documents in Jobs, claimed by
+# in-process workers with a lease. A worker that dies mid-job lets its lease
+# run out and the job is picked up again, so handlers must be idempotent.
+
+register_index("Jobs", [("status", ASCENDING), ("run_at", ASCENDING)])
+register_index("Jobs", [("dedupe_key", ASCENDING)], unique=True,
+               partialFilterExpression={"dedupe_key": {"$type": "string"}})
+register_index("Jobs", [("finished_at", ASCENDING)], expireAfterSeconds=7 * 24 * 3600)
+
+log = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+_handlers: Dict[str, Handler] = {}
+
+def job_handler(kind: str):
+    def register(func: Handler):
+        _handlers[kind] = func
+        return func
+    return register
+
+class JobQueue:
+    def __init__(self, database, concurrency: int = 4, poll_interval: float = 5.0,
+                 max_attempts: int = 5, lease_seconds: int = 60):
+        self.collection = database.Jobs
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._workers = []
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def enqueue(self, kind: str, payload: dict, dedupe_key: Optional[str] = None):
+        """Persist a job; enqueueing the same dedupe_key twice is a no-op."""
+        now = datetime.utcnow()
+        job = {
+            "kind": kind,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "run_at": now,
+            "created_at": now,
+        }
+        if dedupe_key:
+            job["dedupe_key"] = dedupe_key
+        try:
+            await self.collection.insert_one(job)
+        except DuplicateKeyError:
+            return
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        if self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _claim(self):
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "run_at": {"$lte": now}},
+                {"status": "running", "lease_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": "running", "lease_until": now + timedelta(seconds=self.lease_seconds)},
+             "$inc": {"attempts": 1}},
+            sort=[("run_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _work(self):
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                log.warning("Jobs: claim failed: %s", e)
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except Exception as e:
+                # Most likely the status write failed; the job stays leased
+                # and is claimed again once the lease runs out.
+                log.exception("Jobs: %s %s could not be settled: %s", job["kind"], job["_id"], e)
+
+    async def _run(self, job: dict):
+        handler = _handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise LookupError(f"No handler for job kind {job['kind']}")
+            await handler(job["payload"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception("Jobs: %s %s failed (attempt %s): %s", job["kind"], job["_id"], job["attempts"], e)
+            if job["attempts"] >= self.max_attempts:
+                update = {"status": "failed", "error": str(e), "finished_at": datetime.utcnow()}
+            else:
+                backoff = timedelta(seconds=2 ** job["attempts"])
+                update = {"status": "pending", "error": str(e), "run_at": datetime.utcnow() + backoff}
+            await self.collection.update_one({"_id": job["_id"]}, {"$set": update, "$unset": {"lease_until": ""}})
+            return
+        await self.collection.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": "done", "finished_at": datetime.utcnow()}, "$unset": {"lease_until": ""}}
+        )
+
+job_queue = JobQueue(db, concurrency=int(os.getenv("JOB_CONCURRENCY", "4")))
@@ -0,0 +1,178 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import time
+import uuid
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import orjson
+from metrics import Counter, current_route
+
+# Modules log through logging.getLogger(__name__) as usual. setup_logging()
+# puts a QueueHandler on the root logger, so a log call on the event loop
+# only builds the record and drops it on a bounded queue; a QueueListener
+# thread formats the records as JSON lines and writes them to stderr, which
+# leaves stdout to the program's own output such as bench.py's report. When
+# the queue is full, records are dropped and counted rather than waited on.
+#
+# Records carry the request id (X-Request-ID, or a generated one) and the
+# route, and every HTTP request gets one access line. Below WARNING,
+# LOG_SAMPLE_RATES keeps only a share of requests per route; the decision
+# hangs off the request id, so a kept request keeps all of its lines.
+# Token-like fields and bearer tokens are redacted.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Comma-separated route=rate pairs, e.g. "/posts=0.1,/ping=0"; "*" sets the default.
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+REQUEST_ID_HEADER = "X-Request-ID"
+REDACTED = "[redacted]"
+REDACTED_FIELDS = {"authorization", "token", "id_token", "access_token", "refresh_token", "password", "secret"}
+# Bearer credentials and anything shaped like a JWT.
+TOKEN_PATTERN = re.compile(r"(Bearer\s+)\S+|eyJ[\w-]+\.[\w-]+\.[\w-]*", re.IGNORECASE)
+
+# LogRecord attributes that are not extra fields passed by the caller.
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id", "route"}
+
+LOG_DROPPED = Counter("log_records_dropped_total", "Log records dropped because the log queue was full.")
+
+access_log = logging.getLogger("access")
+
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+def _parse_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for pair in spec.split(","):
+        route, _, rate = pair.partition("=")
+        if route.strip() and rate.strip():
+            rates[route.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+def redact(value):
+    if isinstance(value, str):
+        return TOKEN_PATTERN.sub(lambda m: (m.group(1) or "") + REDACTED, value)
+    if isinstance(value, dict):
+        return {key: REDACTED if str(key).lower() in REDACTED_FIELDS else redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+class ContextFilter(logging.Filter):
+    """Runs in the caller, where the request's context is: stamps request id and route, and samples."""
+
+    def __init__(self, sample_rates: Dict[str, float]):
+        super().__init__()
+        self.default_rate = sample_rates.pop("*", 1.0)
+        self.sample_rates = sample_rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        record.route = current_route()
+        if record.levelno >= logging.WARNING or record.request_id is None:
+            return True
+        rate = self.sample_rates.get(record.route, self.default_rate)
+        if rate >= 1.0:
+            return True
+        return zlib.crc32(record.request_id.encode()) / 0x100000000 < rate
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the arguments here; the JSON formatting happens on the listener thread.
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        if getattr(record, "route", None):
+            entry["route"] = record.route
+        extra = {key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS}
+        if extra:
+            entry.update(redact(extra))
+        if record.exc_text:
+            entry["exception"] = redact(record.exc_text)
+        return orjson.dumps(entry, default=str).decode()
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup_logging():
+    """Route the root logger through the queue; safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(ContextFilter(_parse_rates(LOG_SAMPLE_RATES)))
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JSONFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    atexit.register(stop_logging)
+
+def stop_logging():
+    """Write out whatever is still queued."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+class RequestContextMiddleware:
+    """Pure ASGI: sets the request id for HTTP requests and WebSockets, echoes it back
+    and logs an access line per HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        incoming = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"x-request-id"), "")
+        # Ids from clients end up in every log line, so only plain ones are kept.
+        value = incoming if re.fullmatch(r"[A-Za-z0-9_.-]{8,64}", incoming) else uuid.uuid4().hex
+        token = request_id.set(value)
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-request-id", value.encode())]}
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            if scope["type"] == "http":
+                access_log.info("%s %s %d", scope["method"], scope["path"], status,
+                         extra={"status": status, "duration_ms": round((time.perf_counter() - started) * 1000, 2)})
+            request_id.reset(token)
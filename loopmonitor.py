@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+from cachetools import LRUCache
+from metrics import Counter, Histogram, request_tasks, route_label
+
+# A heartbeat task wakes every LOOP_MONITOR_INTERVAL seconds and records how
+# late it woke up: that is the event loop lag every other coroutine saw too.
+# A watchdog thread watches the heartbeat; when it has not beaten for
+# LOOP_BLOCK_THRESHOLD_MS past its interval, the loop is stuck in a
+# synchronous call, so the thread grabs the loop thread's stack and the route
+# of the task that is running. Blocked calls are grouped by the innermost
+# frame of this app's code.
+#
+# In the steady state this is one timer per interval on the loop and one
+# sleeping thread; stacks are only captured while the loop is blocked.
+
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1"))
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+STACK_DEPTH = 20
+
+log = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LOOP_LAG = Histogram("event_loop_lag_seconds", "How late the event loop heartbeat woke up.",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+LOOP_BLOCKS = Counter("event_loop_blocked_total", "Times the event loop was blocked past the threshold.", ("route",))
+
+def _location(frame: traceback.FrameSummary) -> str:
+    return f"{os.path.relpath(frame.filename, APP_DIR)}:{frame.lineno} in {frame.name}"
+
+def _culprit(stack) -> str:
+    """Innermost frame in this app's own code, or the innermost frame at all."""
+    for frame in reversed(stack):
+        if frame.filename.startswith(APP_DIR) and "site-packages" not in frame.filename:
+            return _location(frame)
+    return _location(stack[-1]) if stack else "unknown"
+
+class LoopMonitor:
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold_ms: float = LOOP_BLOCK_THRESHOLD_MS):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.max_lag = 0.0
+        self.blocks = 0
+        # culprit -> {count, total_ms, max_ms, routes, stack}
+        self.offenders = LRUCache(maxsize=100)
+        self._beat = time.monotonic()
+        self._beats = 0
+        # (beat, culprit, route, stack) captured by the watchdog for the current stall
+        self._capture = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            beat = self._beats
+            self._beats += 1
+            self._beat = now
+            LOOP_LAG.observe(value=lag)
+            self.max_lag = max(self.max_lag, lag)
+            capture, self._capture = self._capture, None
+            if capture is not None and capture[0] == beat:
+                self._record(lag, *capture[1:])
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval / 2):
+            beat, last = self._beats, self._beat
+            stalled = time.monotonic() - last - self.interval
+            if stalled < self.threshold or (self._capture is not None and self._capture[0] == beat):
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)[-STACK_DEPTH:]
+            del frame
+            self._capture = (beat, _culprit(stack), self._running_route(), [_location(f) for f in stack])
+
+    def _running_route(self) -> Optional[str]:
+        task = asyncio.current_task(self._loop)
+        scope = request_tasks.get(task) if task is not None else None
+        return route_label(scope) if scope is not None else None
+
+    def _record(self, lag: float, culprit: str, route: Optional[str], stack: list):
+        lag_ms = lag * 1000
+        route = route or "background"
+        self.blocks += 1
+        LOOP_BLOCKS.inc(route)
+        entry = self.offenders.get(culprit)
+        if entry is None:
+            entry = self.offenders[culprit] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "routes": set(), "stack": stack}
+        entry["count"] += 1
+        entry["total_ms"] += lag_ms
+        if lag_ms >= entry["max_ms"]:
+            entry["max_ms"] = lag_ms
+            entry["stack"] = stack
+        entry["routes"].add(route)
+        log.warning("Event loop blocked for %.0fms in %s", lag_ms, culprit,
+                    extra={"blocked_route": route, "stack": stack})
+
+    def report(self) -> dict:
+        offenders = [
+            {"culprit": culprit, **entry, "routes": sorted(entry["routes"])}
+            for culprit, entry in self.offenders.items()
+        ]
+        offenders.sort(key=lambda entry: entry["total_ms"], reverse=True)
+        return {
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "max_lag_ms": self.max_lag * 1000,
+            "blocks": self.blocks,
+            "offenders": offenders,
+        }
+
+loop_monitor = LoopMonitor()
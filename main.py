@@ -1,155 +1,237 @@
-from fastapi import Depends, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
-import traceback
-from app import app, get_current_user, db
-from posts import router as post_router
-from chat import create_chat_router
-from updates import router as update_router
-from profilepage import router as profile_router  
-from news import router as news_router 
-
-app.include_router(news_router)  
-app.include_router(post_router)
-app.include_router(create_chat_router(db))
-app.include_router(update_router)
-app.include_router(profile_router)  
-
-class ProfileData(BaseModel):
-    username: str
-    aboutyou: str
-    likes: List[str]
-    imageUrl: Optional[str] = None
-
-@app.get("/ping")
-def ping():
-    return {"message": "pong"}
-
-@app.post("/Auth")
-async def register_user(user=Depends(get_current_user)):
-    try:
-        firebase_uid = user["uid"]
-        email = user["email"]
-        print(f"Attempting to register user: {email} with UID: {firebase_uid}")
-
-        existing = await db.Users.find_one({"firebase_uid": firebase_uid})
-        if existing:
-            print(f"User already exists: {email}")
-            return {"message": "User already exists", "profile_complete": existing.get("profile_complete", False)}
-
-        user_data = {
-            "firebase_uid": firebase_uid,
-            "email": email,
-            "profile_complete": False,
-            "createdAt": datetime.utcnow()
-        }
-        print(f"Inserting user data: {user_data}")
-        result = await db.Users.insert_one(user_data)
-        print(f"Insert result: {result.inserted_id}")
-
-        return {"message": "User registered", "profile_complete": False}
-    except Exception as e:
-        print(f"Error in register_user: {str(e)} - Stacktrace: {traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-
-@app.post("/complete-profile")
-async def complete_profile(profile_data: ProfileData, user=Depends(get_current_user)):
-    firebase_uid = user["uid"]
-    
-    existing_user = await db.Users.find_one({"firebase_uid": firebase_uid})
-    if not existing_user:
-        raise HTTPException(status_code=404, detail="User not found. Please register first.")
-    
-    username_taken = await db.Users.find_one({
-        "username": profile_data.username,
-        "firebase_uid": {"$ne": firebase_uid}
-    })
-    if username_taken:
-        raise HTTPException(status_code=400, detail="Username already taken")
-    
-    update_data = {
-        "username": profile_data.username,
-        "aboutyou": profile_data.aboutyou,
-        "likes": profile_data.likes,
-        "profile_complete": True,
-        "profileCompletedAt": datetime.utcnow()
-    }
-    
-    if profile_data.imageUrl and profile_data.imageUrl != 'https://via.placeholder.com/300x200?text=Click+to+Upload+Image':
-        update_data["imageUrl"] = profile_data.imageUrl
-    
-    await db.Users.update_one(
-        {"firebase_uid": firebase_uid},
-        {"$set": update_data}
-    )
-    
-    return {"message": "Profile completed successfully"}
-
-@app.get("/profile")
-async def get_user_profile(user=Depends(get_current_user)):
-    firebase_uid = user["uid"]
-    
-    user_data = await db.Users.find_one({"firebase_uid": firebase_uid})
-    if not user_data:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    user_data.pop("_id", None)
-    user_data.pop("firebase_uid", None)
-    
-    return user_data
-
-@app.put("/profile")
-async def update_user_profile(profile_data: ProfileData, user=Depends(get_current_user)):
-    firebase_uid = user["uid"]
-    
-    existing_user = await db.Users.find_one({"firebase_uid": firebase_uid})
-    if not existing_user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    if profile_data.username != existing_user.get("username"):
-        username_taken = await db.Users.find_one({
-            "username": profile_data.username,
-            "firebase_uid": {"$ne": firebase_uid}
-        })
-        if username_taken:
-            raise HTTPException(status_code=400, detail="Username already taken")
-    
-    update_data = {
-        "username": profile_data.username,
-        "aboutyou": profile_data.aboutyou,
-        "likes": profile_data.likes,
-        "updatedAt": datetime.utcnow()
-    }
-    
-    if profile_data.imageUrl and profile_data.imageUrl != 'https://via.placeholder.com/300x200?text=Click+to+Upload+Image':
-        update_data["imageUrl"] = profile_data.imageUrl
-    
-    await db.Users.update_one(
-        {"firebase_uid": firebase_uid},
-        {"$set": update_data}
-    )
-    
-    return {"message": "Profile updated successfully"}
-
-@app.get("/check-username/{username}")
-async def check_username_availability(username: str, user=Depends(get_current_user)):
-    firebase_uid = user["uid"]
-    
-    existing = await db.Users.find_one({
-        "username": username,
-        "firebase_uid": {"$ne": firebase_uid}
-    })
-    
-    return {"available": existing is None}
-
-@app.get("/debug/users")
-async def get_all_users():
-    users = await db.Users.find().to_list(100)
-    for user in users:
-        user["_id"] = str(user["_id"])
-    return {"users": users, "count": len(users)}
-
-if __name__ == "__main__":
-    import uvicorn
+from fastapi import Depends, HTTPException, Response
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+import logging
+from app import app, get_current_user, require_admin, db
+from posts import router as post_router
+from chat import create_chat_router
+from updates import router as update_router
+from profilepage import router as profile_router  
+from news import router as news_router 
+from indexes import register_index, ensure_indexes, index_report
+from engagement import router as engagement_router
+from search import router as search_router
+from timeline import router as timeline_router, interest_tags
+from jobs import job_queue
+from authors import invalidate_author
+from feedcache import feed_cache
+from profilepage import ProfileOut
+from serialization import FastJSONResponse
+from metrics import PROMETHEUS_CONTENT_TYPE, render as render_metrics
+from slowqueries import slow_query_recorder, slow_query_report
+from loopmonitor import loop_monitor
+
+log = logging.getLogger(__name__)
+
+app.include_router(news_router)  
+app.include_router(post_router)
+app.include_router(create_chat_router(db))
+app.include_router(update_router)
+app.include_router(profile_router)  
+app.include_router(engagement_router)
+app.include_router(search_router)
+app.include_router(timeline_router)
+
+register_index("Users", [("firebase_uid", ASCENDING)], unique=True)
+
+@app.on_event("startup")
+async def create_indexes():
+    await ensure_indexes(db)
+
+@app.on_event("startup")
+async def start_job_queue():
+    await job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    await job_queue.stop()
+
+@app.on_event("startup")
+async def start_slow_query_recorder():
+    await slow_query_recorder.start(db)
+
+@app.on_event("shutdown")
+async def stop_slow_query_recorder():
+    await slow_query_recorder.stop()
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    loop_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    loop_monitor.stop()
+
+class ProfileData(BaseModel):
+    username: str
+    aboutyou: str
+    likes: List[str]
+    imageUrl: Optional[str] = None
+
+@app.get("/ping")
+def ping():
+    return {"message": "pong"}
+
+@app.post("/Auth")
+async def register_user(user=Depends(get_current_user)):
+    try:
+        firebase_uid = user["uid"]
+        email = user["email"]
+
+        existing = await db.Users.find_one({"firebase_uid": firebase_uid})
+        if existing:
+            return {"message": "User already exists", "profile_complete": existing.get("profile_complete", False)}
+
+        user_data = {
+            "firebase_uid": firebase_uid,
+            "email": email,
+            "profile_complete": False,
+            "createdAt": datetime.utcnow()
+        }
+        try:
+            await db.Users.insert_one(user_data)
+        except DuplicateKeyError:
+            # A concurrent request registered the same user first.
+            return {"message": "User already exists", "profile_complete": False}
+        log.info("Registered user %s", firebase_uid)
+
+        return {"message": "User registered", "profile_complete": False}
+    except Exception as e:
+        log.exception("Error in register_user: %s", e)
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+@app.post("/complete-profile")
+async def complete_profile(profile_data: ProfileData, user=Depends(get_current_user)):
+    firebase_uid = user["uid"]
+    
+    existing_user = await db.Users.find_one({"firebase_uid": firebase_uid})
+    if not existing_user:
+        raise HTTPException(status_code=404, detail="User not found. Please register first.")
+    
+    # The unique index catches races; this check still holds wherever the
+    # index could not be built (see migrate.py dedupe-usernames).
+    username_taken = await db.Users.find_one({
+        "username": profile_data.username,
+        "firebase_uid": {"$ne": firebase_uid}
+    })
+    if username_taken:
+        raise HTTPException(status_code=400, detail="Username already taken")
+    
+    update_data = {
+        "username": profile_data.username,
+        "aboutyou": profile_data.aboutyou,
+        "likes": profile_data.likes,
+        "interest_tags": interest_tags(profile_data.likes),
+        "profile_complete": True,
+        "profileCompletedAt": datetime.utcnow(),
+        "updatedAt": datetime.utcnow()
+    }
+    
+    if profile_data.imageUrl and profile_data.imageUrl != 'https://via.placeholder.com/300x200?text=Click+to+Upload+Image':
+        update_data["imageUrl"] = profile_data.imageUrl
+    
+    try:
+        await db.Users.update_one(
+            {"firebase_uid": firebase_uid},
+            {"$set": update_data}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Username already taken")
+    invalidate_author(firebase_uid)
+    
+    return {"message": "Profile completed successfully"}
+
+@app.get("/profile", response_model=ProfileOut, response_model_exclude_unset=True)
+async def get_user_profile(user=Depends(get_current_user)):
+    firebase_uid = user["uid"]
+    
+    user_data = await db.Users.find_one({"firebase_uid": firebase_uid})
+    if not user_data:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    return user_data
+
+@app.put("/profile")
+async def update_user_profile(profile_data: ProfileData, user=Depends(get_current_user)):
+    firebase_uid = user["uid"]
+    
+    existing_user = await db.Users.find_one({"firebase_uid": firebase_uid})
+    if not existing_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    if profile_data.username != existing_user.get("username"):
+        username_taken = await db.Users.find_one({
+            "username": profile_data.username,
+            "firebase_uid": {"$ne": firebase_uid}
+        })
+        if username_taken:
+            raise HTTPException(status_code=400, detail="Username already taken")
+    
+    update_data = {
+        "username": profile_data.username,
+        "aboutyou": profile_data.aboutyou,
+        "likes": profile_data.likes,
+        "interest_tags": interest_tags(profile_data.likes),
+        "updatedAt": datetime.utcnow()
+    }
+    
+    if profile_data.imageUrl and profile_data.imageUrl != 'https://via.placeholder.com/300x200?text=Click+to+Upload+Image':
+        update_data["imageUrl"] = profile_data.imageUrl
+    
+    try:
+        await db.Users.update_one(
+            {"firebase_uid": firebase_uid},
+            {"$set": update_data}
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Username already taken")
+    invalidate_author(firebase_uid)
+    
+    return {"message": "Profile updated successfully"}
+
+@app.get("/check-username/{username}")
+async def check_username_availability(username: str, user=Depends(get_current_user)):
+    firebase_uid = user["uid"]
+    
+    existing = await db.Users.find_one({
+        "username": username,
+        "firebase_uid": {"$ne": firebase_uid}
+    })
+    
+    return {"available": existing is None}
+
+@app.get("/debug/indexes")
+async def get_index_report(user=Depends(require_admin)):
+    return await index_report(db)
+
+@app.get("/debug/feed-cache")
+async def get_feed_cache_stats(user=Depends(require_admin)):
+    return feed_cache.metrics()
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    return Response(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.get("/debug/slow-queries")
+async def get_slow_queries(since_minutes: Optional[int] = None, collscan: bool = False, limit: int = 50, user=Depends(require_admin)):
+    try:
+        return await slow_query_report(db, since_minutes, collscan, min(max(limit, 1), 500))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to build slow query report: {str(e)}")
+
+@app.get("/debug/event-loop")
+async def get_event_loop_report(user=Depends(require_admin)):
+    return loop_monitor.report()
+
+@app.get("/debug/users")
+async def get_all_users():
+    users = await db.Users.find().to_list(100)
+    # Raw documents go straight to orjson, which handles the ObjectIds.
+    return FastJSONResponse({"users": users, "count": len(users)})
+
+if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
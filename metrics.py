@@ -0,0 +1,242 @@
+import asyncio
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+from weakref import WeakKeyDictionary
+from pymongo import monitoring
+
+# In-process metrics in the Prometheus text format, served at /metrics.
+# Recording is a dict lookup plus a few additions under a lock, cheap enough
+# for every request and every Mongo command. Each worker process keeps its own
+# numbers; Prometheus scrapes and sums them per instance.
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in values]
+
+class Gauge(_Metric):
+    """A settable value, or one read from `function` at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, *args, function: Optional[Callable[[], float]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+        self.function = function
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def collect(self) -> List[str]:
+        if self.function is not None:
+            return [f"{self.name} {_number(self.function())}"]
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in values]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets=LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (the last one is +Inf), sum]
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, *labels, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        lines = []
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+REGISTRY: List[_Metric] = []
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.header())
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+# The route is only known once routing has run, so requests in flight are counted per method.
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being served.", ("method",))
+HTTP_MONGO_TIME = Histogram("http_request_mongo_seconds", "Time spent in Mongo commands per request.",
+                            ("method", "route"), buckets=MONGO_BUCKETS)
+HTTP_MONGO_ROUND_TRIPS = Histogram("http_request_mongo_round_trips", "Mongo commands issued per request.",
+                                   ("method", "route"), buckets=ROUND_TRIP_BUCKETS)
+MONGO_COMMANDS = Counter("mongo_commands_total", "Mongo commands by name and outcome.", ("command", "outcome"))
+MONGO_LATENCY = Histogram("mongo_command_duration_seconds", "Mongo command latency.", ("command",), buckets=MONGO_BUCKETS)
+
+class RequestStats:
+    __slots__ = ("scope", "mongo_seconds", "mongo_commands")
+
+    def __init__(self, scope):
+        # Routing fills in scope["route"], so route_label(stats.scope) works from inside the endpoint.
+        self.scope = scope
+        self.mongo_seconds = 0.0
+        self.mongo_commands = 0
+
+# Set for the duration of each HTTP request. Motor runs commands on its
+# executor threads with a copy of the caller's context, so the listener below
+# sees the stats object of the request that issued the command.
+request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+# task -> ASGI scope of the request or socket it serves, for code that cannot
+# see the task's context, such as the event loop watchdog thread.
+request_tasks: "WeakKeyDictionary[asyncio.Task, dict]" = WeakKeyDictionary()
+
+class CommandMetrics(monitoring.CommandListener):
+    """Mongo command latency, in total and attributed to the current request."""
+
+    def started(self, event):
+        pass
+
+    def _record(self, event, outcome: str):
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMANDS.inc(event.command_name, outcome)
+        MONGO_LATENCY.observe(event.command_name, value=seconds)
+        stats = request_stats.get()
+        if stats is not None:
+            stats.mongo_seconds += seconds
+            stats.mongo_commands += 1
+
+    def succeeded(self, event):
+        self._record(event, "ok")
+
+    def failed(self, event):
+        self._record(event, "error")
+
+command_metrics = CommandMetrics()
+
+def current_route() -> Optional[str]:
+    """Route of the HTTP request this code runs for, or None outside of one."""
+    stats = request_stats.get()
+    return route_label(stats.scope) if stats is not None else None
+
+def route_label(scope) -> str:
+    # The path template, never the raw path, so ids in URLs do not create new series.
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+class MetricsMiddleware:
+    """Pure ASGI: latency, status and Mongo usage per route for every HTTP request.
+
+    It also files each request's task under request_tasks; WebSocket
+    connections are filed there too but not timed.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            if scope["type"] != "websocket":
+                await self.app(scope, receive, send)
+                return
+            task = asyncio.current_task()
+            request_tasks[task] = scope
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                request_tasks.pop(task, None)
+            return
+        task = asyncio.current_task()
+        request_tasks[task] = scope
+        method = scope["method"]
+        status = 500
+        stats = RequestStats(scope)
+        token = request_stats.set(stats)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc(method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_PROGRESS.dec(method)
+            request_stats.reset(token)
+            request_tasks.pop(task, None)
+            route = route_label(scope)
+            HTTP_REQUESTS.inc(method, route, str(status))
+            HTTP_LATENCY.observe(method, route, value=elapsed)
+            HTTP_MONGO_TIME.observe(method, route, value=stats.mongo_seconds)
+            HTTP_MONGO_ROUND_TRIPS.observe(method, route, value=stats.mongo_commands)
@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from db import db
+
+# Run once before deploying code that relies on a migration, e.g.
+#   python migrate.py backfill-counters
+
+async def backfill_counters():
+    """Set like_count/save_count/comment_count from the existing arrays."""
+    for collection in (db.Posts, db.Updates):
+        result = await collection.update_many(
+            {"$or": [
+                {"like_count": {"$exists": False}},
+                {"save_count": {"$exists": False}},
+                {"comment_count": {"$exists": False}},
+            ]},
+            [{"$set": {
+                "like_count": {"$size": {"$ifNull": ["$likes", []]}},
+                "save_count": {"$size": {"$ifNull": ["$saves", []]}},
+                "comment_count": {"$size": {"$ifNull": ["$comments", []]}},
+            }}]
+        )
+        print(f"{collection.name}: backfilled counters on {result.modified_count} documents")
+
+async def migrate_comments():
+    """Move embedded comments arrays into the Comments collection.
+
+    Comments keep their comment_id as _id, so re-running after a partial
+    failure skips the ones that were already copied.
+    """
+    for collection, parent_type in ((db.Posts, "post"), (db.Updates, "update")):
+        moved = 0
+        async for parent in collection.find({"comments.0": {"$exists": True}}, {"comments": 1}):
+            docs = []
+            for comment in parent["comments"]:
+                comment_id = comment.get("comment_id")
+                _id = ObjectId(comment_id) if comment_id and ObjectId.is_valid(comment_id) else ObjectId()
+                docs.append({**comment, "_id": _id, "comment_id": str(_id), "parent_id": parent["_id"], "parent_type": parent_type})
+            try:
+                await db.Comments.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+            count = await db.Comments.count_documents({"parent_id": parent["_id"]})
+            await collection.update_one(
+                {"_id": parent["_id"]},
+                {"$set": {"comment_count": count}, "$unset": {"comments": ""}}
+            )
+            moved += len(docs)
+        print(f"{collection.name}: moved {moved} comments")
+
+async def backfill_interest_tags():
+    """Derive interest_tags from profile likes; re-run whenever the tag rules change."""
+    from timeline import interest_tags
+    ops, updated = [], 0
+    async for user in db.Users.find({"likes.0": {"$exists": True}}, {"likes": 1, "interest_tags": 1}):
+        tags = interest_tags(user["likes"])
+        if user.get("interest_tags") == tags:
+            continue
+        ops.append(UpdateOne({"_id": user["_id"]}, {"$set": {"interest_tags": tags}}))
+        updated += 1
+        if len(ops) >= 1000:
+            await db.Users.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db.Users.bulk_write(ops, ordered=False)
+    print(f"Users: backfilled interest_tags on {updated} documents")
+
+async def backfill_edges():
+    """Copy the liked/saved arrays on Users into Edges, then drop the arrays.
+
+    The arrays hold no timestamps, so edges get created_at values a
+    millisecond apart that keep the array's order, oldest first. Upserts
+    with $setOnInsert leave edges written since the deploy untouched.
+    """
+    fields = ("liked_posts", "saved_posts", "liked_updates", "saved_updates")
+    moved = 0
+    query = {"$or": [{field: {"$exists": True}} for field in fields]}
+    async for user in db.Users.find(query, {"firebase_uid": 1, **{field: 1 for field in fields}}):
+        uid = user.get("firebase_uid")
+        base = datetime.utcnow()
+        ops = []
+        for field in fields:
+            target_ids = user.get(field) or []
+            for index, target_id in enumerate(target_ids):
+                created_at = base - timedelta(milliseconds=len(target_ids) - index)
+                ops.append(UpdateOne(
+                    {"user_id": uid, "kind": field, "target_id": target_id},
+                    {"$setOnInsert": {"created_at": created_at}},
+                    upsert=True,
+                ))
+        if uid and ops:
+            try:
+                await db.Edges.bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                # Two upserts racing on the unique index; the edge exists either way.
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+            moved += len(ops)
+        await db.Users.update_one({"_id": user["_id"]}, {"$unset": {field: "" for field in fields}})
+    print(f"Edges: backfilled {moved} edges")
+
+async def backfill_timelines():
+    """Fan out the posts still inside the timeline TTL, for timelines started after they were posted."""
+    from timeline import TIMELINE_TTL_DAYS, fan_out_post
+    since = datetime.utcnow() - timedelta(days=TIMELINE_TTL_DAYS)
+    fanned = 0
+    # Upserts keyed by (user, post), so re-running rewrites the same entries.
+    async for post in db.Posts.find({"created_at": {"$gte": since}}, {"_id": 1}).sort("created_at", 1):
+        await fan_out_post({"post_id": str(post["_id"])})
+        fanned += 1
+    print(f"Timelines: fanned out {fanned} posts")
+
+async def dedupe_usernames():
+    """Rename all but the oldest holder of each duplicated username.
+
+    The unique index on Users.username cannot be built while duplicates exist;
+    run this, then restart the app (or `python indexes.py --apply`).
+    """
+    renamed = 0
+    duplicates = db.Users.aggregate([
+        {"$match": {"username": {"$type": "string"}}},
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": "$username", "users": {"$push": {"_id": "$_id", "firebase_uid": "$firebase_uid"}}}},
+        {"$match": {"users.1": {"$exists": True}}},
+    ])
+    async for group in duplicates:
+        for user in group["users"][1:]:
+            uid = user.get("firebase_uid") or str(user["_id"])
+            new_name = f"{group['_id']}-{uid[:6]}"
+            if await db.Users.find_one({"username": new_name}):
+                new_name = f"{group['_id']}-{uid}"
+            await db.Users.update_one({"_id": user["_id"]}, {"$set": {"username": new_name, "updatedAt": datetime.utcnow()}})
+            print(f"Users: renamed {uid} from {group['_id']} to {new_name}")
+            renamed += 1
+    print(f"Users: renamed {renamed} duplicate usernames")
+
+MIGRATIONS = {
+    "backfill-counters": backfill_counters,
+    "migrate-comments": migrate_comments,
+    "backfill-interest-tags": backfill_interest_tags,
+    "backfill-edges": backfill_edges,
+    "backfill-timelines": backfill_timelines,
+    "dedupe-usernames": dedupe_usernames,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="One-off data migrations")
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    args = parser.parse_args()
+    asyncio.run(MIGRATIONS[args.migration]())
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,97 @@
-# news.py
-from fastapi import APIRouter, Depends, HTTPException
-from bson import ObjectId
-from datetime import datetime
-from pydantic import BaseModel
-from typing import List, Optional
-from app import get_current_user, db
-
-router = APIRouter()
-
-class NewsModel(BaseModel):
-    title: str
-    content: str
-    url: Optional[str] = None
-    author: str
-
-@router.post("/news")
-async def create_news(news: NewsModel, user=Depends(get_current_user)):
-    try:
-        news_data = {
-            "title": news.title,
-            "content": news.content,
-            "url": news.url or "",
-            "author": news.author,
-            "date": datetime.utcnow()
-        }
-        
-        result = await db.News.insert_one(news_data)
-        return {"message": "News created", "news_id": str(result.inserted_id)}
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to create news: {str(e)}")
-
-@router.get("/news")
-async def get_all_news(page: int = 1, limit: int = 10, user=Depends(get_current_user)):
-    try:
-        skip = (page - 1) * limit
-        news = await db.News.find().sort("date", -1).skip(skip).limit(limit).to_list(limit)
-        
-        for item in news:
-            item["_id"] = str(item["_id"])
-            
-        return news
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch news: {str(e)}")
-
-@router.delete("/news/{news_id}")
-async def delete_news(news_id: str, user=Depends(get_current_user)):
-    try:
-        if not ObjectId.is_valid(news_id):
-            raise HTTPException(status_code=400, detail="Invalid news ID")
-            
-        news = await db.News.find_one({"_id": ObjectId(news_id)})
-        if not news:
-            raise HTTPException(status_code=404, detail="News not found")
-            
-        await db.News.delete_one({"_id": ObjectId(news_id)})
-        return {"message": "News deleted successfully"}
-        
-    except Exception as e:
+# news.py
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from bson import ObjectId
+from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from pymongo import DESCENDING
+from app import get_current_user, db
+from indexes import register_index
+from feedcache import feed_cache
+from etags import conditional, feed_etag
+from pagination import NEXT_CURSOR_HEADER, clamp_limit, keyset_sort, next_cursor, page_query
+from serialization import ObjectIdStr
+
+router = APIRouter()
+
+register_index("News", [("date", DESCENDING), ("_id", DESCENDING)])
+
+class NewsModel(BaseModel):
+    title: str
+    content: str
+    url: Optional[str] = None
+    author: str
+
+class NewsItem(BaseModel):
+    id: ObjectIdStr = Field(alias="_id")
+    title: Optional[str] = None
+    content: Optional[str] = None
+    url: Optional[str] = None
+    author: Optional[str] = None
+    date: Optional[datetime] = None
+
+@router.post("/news")
+async def create_news(news: NewsModel, user=Depends(get_current_user)):
+    try:
+        news_data = {
+            "title": news.title,
+            "content": news.content,
+            "url": news.url or "",
+            "author": news.author,
+            "date": datetime.utcnow()
+        }
+        
+        result = await db.News.insert_one(news_data)
+        feed_cache.invalidate("News")
+        return {"message": "News created", "news_id": str(result.inserted_id)}
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create news: {str(e)}")
+
+@router.get("/news", response_model=List[NewsItem])
+async def get_all_news(request: Request, response: Response, cursor: Optional[str] = None, page: int = 1, limit: int = 10, user=Depends(get_current_user)):
+    try:
+        limit = clamp_limit(limit)
+        query = page_query({}, "date", cursor)
+        skip = (page - 1) * limit if not cursor and page > 1 else 0
+
+        async def load():
+            find = db.News.find(query).sort(keyset_sort("date"))
+            if skip:
+                find = find.skip(skip)
+            return await find.limit(limit).to_list(limit)
+
+        tag, news = await feed_cache.fetch("News", (repr(query), limit, skip), load)
+        
+        cursor_out = next_cursor(news, "date", limit)
+        if cursor_out:
+            response.headers[NEXT_CURSOR_HEADER] = cursor_out
+        
+        # News carries no per-viewer fields, so every viewer shares one validator.
+        not_modified = conditional(request, response, feed_etag("News", tag))
+        if not_modified:
+            return not_modified
+            
+        return news
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch news: {str(e)}")
+
+@router.delete("/news/{news_id}")
+async def delete_news(news_id: str, user=Depends(get_current_user)):
+    try:
+        if not ObjectId.is_valid(news_id):
+            raise HTTPException(status_code=400, detail="Invalid news ID")
+            
+        news = await db.News.find_one({"_id": ObjectId(news_id)})
+        if not news:
+            raise HTTPException(status_code=404, detail="News not found")
+            
+        await db.News.delete_one({"_id": ObjectId(news_id)})
+        feed_cache.invalidate("News")
+        return {"message": "News deleted successfully"}
+        
+    except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete news: {str(e)}")
\ No newline at end of file
@@ -148,13 +148,14 @@ export default function UpdatesPage() {
         return;
       }
 
+      const result = await response.json();
       setItems((prev) =>
         prev.map((item) =>
           item._id === updateId
             ? {
                 ...item,
-                liked: !isLiked,
-                like_count: item.like_count + (isLiked ? -1 : 1),
+                liked: result.liked,
+                like_count: result.like_count,
               }
             : item,
         ),
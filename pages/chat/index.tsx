@@ -104,11 +104,15 @@ export default function ChatPage() {
 
       socket.onmessage = (event) => {
         const data = JSON.parse(event.data);
+        const incoming = data.type === "history" ? data.messages : [data];
         setMessages((prev) => {
-          const isDuplicate = prev.some(
-            (msg) => msg.timestamp === data.timestamp && msg.sender_id === data.sender_id
+          const fresh = incoming.filter(
+            (next: any) =>
+              !prev.some(
+                (msg) => msg.timestamp === next.timestamp && msg.sender_id === next.sender_id
+              )
           );
-          return isDuplicate ? prev : [...prev, data];
+          return fresh.length > 0 ? [...prev, ...fresh] : prev;
         });
       };
 
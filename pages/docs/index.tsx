@@ -157,13 +157,14 @@ export default function DocsPage() {
       });
 
       if (response.ok) {
+        const result = await response.json();
         setPosts((prevPosts) =>
           prevPosts.map((p) =>
             p._id === postId
               ? {
                   ...p,
-                  liked: !p.liked,
-                  like_count: p.liked ? p.like_count - 1 : p.like_count + 1,
+                  liked: result.liked,
+                  like_count: result.like_count,
                 }
               : p,
           ),
@@ -203,13 +204,14 @@ export default function DocsPage() {
       });
 
       if (response.ok) {
+        const result = await response.json();
         setPosts((prevPosts) =>
           prevPosts.map((p) =>
             p._id === postId
               ? {
                   ...p,
-                  saved: !p.saved,
-                  save_count: p.saved ? p.save_count - 1 : p.save_count + 1,
+                  saved: result.saved,
+                  save_count: result.save_count,
                 }
               : p,
           ),
@@ -0,0 +1,66 @@
+import base64
+import json
+from datetime import datetime
+from bson import ObjectId
+from fastapi import HTTPException
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_PAGE_SIZE = 100
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"d": value.isoformat()}
+    if isinstance(value, ObjectId):
+        return {"o": str(value)}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if "d" in value:
+            return datetime.fromisoformat(value["d"])
+        if "o" in value:
+            return ObjectId(value["o"])
+    return value
+
+def encode_cursor(*values) -> str:
+    payload = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return [_decode_value(v) for v in values]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def clamp_limit(limit: int) -> int:
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def keyset_sort(field: str):
+    return [(field, -1), ("_id", -1)]
+
+def keyset_filter(field: str, cursor: str, tiebreak: str = "_id") -> dict:
+    """Match everything strictly after the cursor in (field desc, tiebreak desc) order."""
+    values = decode_cursor(cursor)
+    if len(values) != 2 or not isinstance(values[1], ObjectId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    value, last_id = values
+    return {"$or": [
+        {field: {"$lt": value}},
+        {field: value, tiebreak: {"$lt": last_id}},
+    ]}
+
+def page_query(query: dict, field: str, cursor=None, tiebreak: str = "_id") -> dict:
+    if not cursor:
+        return query
+    if not query:
+        return keyset_filter(field, cursor, tiebreak)
+    return {"$and": [query, keyset_filter(field, cursor, tiebreak)]}
+
+def next_cursor(docs: list, field: str, limit: int):
+    """Cursor for the page after `docs`, or None when this was the last page."""
+    if len(docs) < limit:
+        return None
+    last = docs[-1]
+    return encode_cursor(last[field], ObjectId(last["_id"]))
@@ -1,122 +1,164 @@
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional, Dict
-from datetime import datetime
-from app import get_current_user, db
-
-router = APIRouter()
-
-class SocialLinks(BaseModel):
-    spotify: Optional[str] = ""
-    letterboxd: Optional[str] = ""
-    discord: Optional[str] = ""
-    instagram: Optional[str] = ""
-    twitter: Optional[str] = ""
-    website: Optional[str] = ""
-
-class YapTopic(BaseModel):
-    name: Optional[str] = ""
-    description: Optional[str] = ""
-
-class ProfileData(BaseModel):
-    username: str
-    aboutyou: str
-    likes: List[str]
-    imageUrl: Optional[str] = None
-    mood: Optional[str] = ""
-    status: Optional[str] = ""
-    socialLinks: Optional[SocialLinks] = None
-    age: Optional[str] = ""
-    title: Optional[str] = ""
-    location: Optional[str] = ""
-    yapTopics: Optional[Dict[str, YapTopic]] = None
-
-@router.get("/profile/{username}")
-async def get_user_profile_by_username(username: str, user=Depends(get_current_user)):
-    try:
-        user_data = await db.Users.find_one({"username": username})
-        if not user_data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        can_edit = user_data.get("firebase_uid") == user["uid"] if user else False
-        
-        user_data.pop("_id", None)
-        user_data.pop("firebase_uid", None)
-        
-        user_data["canEdit"] = can_edit
-        
-        return user_data
-    
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch profile: {str(e)}")
-
-@router.get("/profile/{username}/posts")
-async def get_user_posts(username: str):
-    try:
-        user_data = await db.Users.find_one({"username": username})
-        if not user_data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        posts = await db.Posts.find({"user_id": user_data["firebase_uid"]}).sort("created_at", -1).to_list(100)
-        
-        for post in posts:
-            post["_id"] = str(post["_id"])
-            post["like_count"] = len(post.get("likes", []))
-            post["save_count"] = len(post.get("saves", []))
-            post["comment_count"] = len(post.get("comments", []))
-        
-        return posts
-    
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch user posts: {str(e)}")
-
-@router.put("/profile/{username}")
-async def update_user_profile(username: str, profile_data: ProfileData, user=Depends(get_current_user)):
-    try:
-        existing_user = await db.Users.find_one({"username": username})
-        if not existing_user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        if existing_user["firebase_uid"] != user["uid"]:
-            raise HTTPException(status_code=403, detail="You can only edit your own profile")
-        
-        if profile_data.username != username:
-            username_taken = await db.Users.find_one({
-                "username": profile_data.username,
-                "firebase_uid": {"$ne": user["uid"]}
-            })
-            if username_taken:
-                raise HTTPException(status_code=400, detail="Username already taken")
-        
-        update_data = {
-            "username": profile_data.username,
-            "aboutyou": profile_data.aboutyou,
-            "likes": profile_data.likes,
-            "mood": profile_data.mood,
-            "status": profile_data.status,
-            "socialLinks": profile_data.socialLinks.dict() if profile_data.socialLinks else {},
-            "age": profile_data.age,
-            "title": profile_data.title,
-            "location": profile_data.location,
-            "yapTopics": {k: v.dict() for k, v in profile_data.yapTopics.items()} if profile_data.yapTopics else {},
-            "updatedAt": datetime.utcnow()
-        }
-        
-        if profile_data.imageUrl and profile_data.imageUrl != 'https://via.placeholder.com/300x200?text=Click+to+Upload+Image':
-            update_data["imageUrl"] = profile_data.imageUrl
-        
-        await db.Users.update_one(
-            {"firebase_uid": user["uid"]},
-            {"$set": update_data}
-        )
-        
-        return {"message": "Profile updated successfully"}
-    
-    except HTTPException:
-        raise
-    except Exception as e:
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from pydantic import BaseModel
+from typing import Any, List, Optional, Dict
+from datetime import datetime
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+from app import get_current_user, db
+from engagement import FeedItem, cached_page, present_feed
+from etags import conditional, feed_etag, make_etag
+from authors import invalidate_author
+from indexes import register_index
+from pagination import keyset_sort
+from timeline import interest_tags
+
+router = APIRouter()
+
+# Users without a completed profile have no username, so only enforce
+# uniqueness on documents that actually have one.
+register_index("Users", [("username", ASCENDING)], unique=True,
+               partialFilterExpression={"username": {"$type": "string"}})
+
+# The engagement edges change on every like and are not part of the profile.
+PROFILE_PROJECTION = {"liked_posts": 0, "saved_posts": 0, "liked_updates": 0, "saved_updates": 0}
+
+class SocialLinks(BaseModel):
+    spotify: Optional[str] = ""
+    letterboxd: Optional[str] = ""
+    discord: Optional[str] = ""
+    instagram: Optional[str] = ""
+    twitter: Optional[str] = ""
+    website: Optional[str] = ""
+
+class YapTopic(BaseModel):
+    name: Optional[str] = ""
+    description: Optional[str] = ""
+
+class ProfileOut(BaseModel):
+    email: Optional[str] = None
+    username: Optional[str] = None
+    aboutyou: Optional[str] = None
+    likes: Optional[List[str]] = None
+    imageUrl: Optional[str] = None
+    mood: Optional[str] = None
+    status: Optional[str] = None
+    socialLinks: Optional[Dict[str, Any]] = None
+    age: Optional[str] = None
+    title: Optional[str] = None
+    location: Optional[str] = None
+    yapTopics: Optional[Dict[str, Any]] = None
+    profile_complete: Optional[bool] = None
+    createdAt: Optional[datetime] = None
+    updatedAt: Optional[datetime] = None
+    canEdit: Optional[bool] = None
+
+class ProfileData(BaseModel):
+    username: str
+    aboutyou: str
+    likes: List[str]
+    imageUrl: Optional[str] = None
+    mood: Optional[str] = ""
+    status: Optional[str] = ""
+    socialLinks: Optional[SocialLinks] = None
+    age: Optional[str] = ""
+    title: Optional[str] = ""
+    location: Optional[str] = ""
+    yapTopics: Optional[Dict[str, YapTopic]] = None
+
+@router.get("/profile/{username}", response_model=ProfileOut, response_model_exclude_unset=True)
+async def get_user_profile_by_username(username: str, request: Request, response: Response, user=Depends(get_current_user)):
+    try:
+        user_data = await db.Users.find_one({"username": username}, PROFILE_PROJECTION)
+        if not user_data:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        can_edit = user_data.get("firebase_uid") == user["uid"] if user else False
+        
+        # Every profile write stamps updatedAt, so it versions the whole document.
+        version = user_data.get("updatedAt") or user_data.get("createdAt")
+        not_modified = conditional(request, response, make_etag("profile", user_data["_id"], version, can_edit))
+        if not_modified:
+            return not_modified
+        
+        user_data["canEdit"] = can_edit
+        
+        return user_data
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch profile: {str(e)}")
+
+@router.get("/profile/{username}/posts", response_model=List[FeedItem])
+async def get_user_posts(username: str, request: Request, response: Response):
+    try:
+        user_data = await db.Users.find_one({"username": username}, {"firebase_uid": 1})
+        if not user_data:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        tag, page = await cached_page(db.Posts, {"user_id": user_data["firebase_uid"]}, sort=keyset_sort("created_at"), limit=100)
+        
+        not_modified = conditional(request, response, feed_etag("Posts", tag))
+        if not_modified:
+            return not_modified
+        
+        return await present_feed(db.Posts, page)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch user posts: {str(e)}")
+
+@router.put("/profile/{username}")
+async def update_user_profile(username: str, profile_data: ProfileData, user=Depends(get_current_user)):
+    try:
+        existing_user = await db.Users.find_one({"username": username})
+        if not existing_user:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        if existing_user["firebase_uid"] != user["uid"]:
+            raise HTTPException(status_code=403, detail="You can only edit your own profile")
+        
+        # The unique index catches races; this check still holds wherever
+        # the index could not be built (see migrate.py dedupe-usernames).
+        if profile_data.username != username:
+            username_taken = await db.Users.find_one({
+                "username": profile_data.username,
+                "firebase_uid": {"$ne": user["uid"]}
+            })
+            if username_taken:
+                raise HTTPException(status_code=400, detail="Username already taken")
+        
+        update_data = {
+            "username": profile_data.username,
+            "aboutyou": profile_data.aboutyou,
+            "likes": profile_data.likes,
+            "interest_tags": interest_tags(profile_data.likes),
+            "mood": profile_data.mood,
+            "status": profile_data.status,
+            "socialLinks": profile_data.socialLinks.dict() if profile_data.socialLinks else {},
+            "age": profile_data.age,
+            "title": profile_data.title,
+            "location": profile_data.location,
+            "yapTopics": {k: v.dict() for k, v in profile_data.yapTopics.items()} if profile_data.yapTopics else {},
+            "updatedAt": datetime.utcnow()
+        }
+        
+        if profile_data.imageUrl and profile_data.imageUrl != 'https://via.placeholder.com/300x200?text=Click+to+Upload+Image':
+            update_data["imageUrl"] = profile_data.imageUrl
+        
+        try:
+            await db.Users.update_one(
+                {"firebase_uid": user["uid"]},
+                {"$set": update_data}
+            )
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="Username already taken")
+        invalidate_author(user["uid"])
+        
+        return {"message": "Profile updated successfully"}
+    
+    except HTTPException:
+        raise
+    except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update profile: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+from indexes import register_index
+
+# Chat messages are published to a backend and every worker delivers what it
+# receives to its own sockets only. The in-memory backend is enough for a
+# single process; the Mongo backend relays through a change stream so any
+# number of workers (on any number of nodes) see every message.
+
+log = logging.getLogger(__name__)
+
+Deliver = Callable[[dict], Awaitable[None]]
+
+CHAT_EVENTS_TTL_SECONDS = 3600
+
+register_index("ChatEvents", [("created_at", ASCENDING)], expireAfterSeconds=CHAT_EVENTS_TTL_SECONDS)
+
+class BroadcastBackend(ABC):
+    @abstractmethod
+    async def start(self, deliver: Deliver):
+        """Begin handing every published message, from any worker, to deliver."""
+
+    @abstractmethod
+    async def publish(self, message: dict):
+        """Send message to every worker, this one included."""
+
+    async def stop(self):
+        pass
+
+class InMemoryBackend(BroadcastBackend):
+    def __init__(self):
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+
+    async def publish(self, message: dict):
+        if self._deliver is not None:
+            await self._deliver(message)
+
+class MongoChangeStreamBackend(BroadcastBackend):
+    """Relay messages through a ChatEvents collection watched by every worker.
+
+    Needs a replica set (change streams are unavailable on a standalone
+    mongod). Events expire after an hour; they are only a transport.
+    """
+
+    def __init__(self, db, retry_delay: float = 1.0):
+        self.collection = db.ChatEvents
+        self.retry_delay = retry_delay
+        self._task: Optional[asyncio.Task] = None
+        self._deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self._deliver = deliver
+        self._task = asyncio.create_task(self._listen())
+
+    async def publish(self, message: dict):
+        await self.collection.insert_one({"message": message, "created_at": datetime.utcnow()})
+
+    async def _listen(self):
+        resume_token = None
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        while True:
+            try:
+                async with self.collection.watch(pipeline, resume_after=resume_token) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        try:
+                            await self._deliver(change["fullDocument"]["message"])
+                        except Exception as e:
+                            log.exception("Chat backend: delivery failed: %s", e)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                if isinstance(e, OperationFailure):
+                    # The resume point may have fallen off the oplog; start fresh.
+                    resume_token = None
+                log.warning("Chat backend: change stream interrupted, retrying: %s", e)
+                await asyncio.sleep(self.retry_delay)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+def backend_from_env(db) -> BroadcastBackend:
+    kind = os.getenv("CHAT_BROADCAST_BACKEND", "memory")
+    if kind == "memory":
+        return InMemoryBackend()
+    if kind == "mongo":
+        return MongoChangeStreamBackend(db)
+    raise ValueError(f"Unknown CHAT_BROADCAST_BACKEND: {kind}")
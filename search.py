@@ -0,0 +1,136 @@
+import asyncio
+from datetime import datetime
+from typing import List, Optional
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel, Field
+from pymongo import TEXT
+from app import get_current_user, db
+from authors import hydrate_authors
+from indexes import register_index
+from pagination import clamp_limit, decode_cursor, encode_cursor
+from serialization import ObjectIdStr
+
+router = APIRouter()
+
+# kind -> (collection, field holding the publication date)
+SEARCHABLE = {
+    "news": ("News", "date"),
+    "post": ("Posts", "created_at"),
+    "update": ("Updates", "created_at"),
+}
+
+# One text index per collection; a title hit counts for more than a body hit.
+for collection_name, _ in SEARCHABLE.values():
+    register_index(collection_name, [("title", TEXT), ("content", TEXT)],
+                   weights={"title": 3, "content": 1}, name="search_text")
+
+class SearchResult(BaseModel):
+    kind: str
+    id: ObjectIdStr = Field(alias="_id")
+    score: float
+    title: Optional[str] = None
+    content: Optional[str] = None
+    created_at: Optional[datetime] = None
+    user_id: Optional[str] = None
+    username: Optional[str] = None
+    imageUrl: Optional[str] = None
+    author: Optional[str] = None
+    like_count: Optional[int] = None
+    comment_count: Optional[int] = None
+
+class SearchPage(BaseModel):
+    results: List[SearchResult]
+    next_cursor: Optional[str] = None
+
+def _sort_key(doc: dict):
+    # Results are ordered by (score desc, kind asc, _id desc) across all collections.
+    return (-doc["score"], doc["kind"], -int(str(doc["_id"]), 16))
+
+def _after(kind: str, cursor) -> Optional[dict]:
+    """$match on score/_id for the results of `kind` that come after the cursor."""
+    if cursor is None:
+        return None
+    score, cursor_kind, last_id = cursor
+    if kind > cursor_kind:
+        return {"score": {"$lte": score}}
+    if kind < cursor_kind:
+        return {"score": {"$lt": score}}
+    return {"$or": [
+        {"score": {"$lt": score}},
+        {"score": score, "_id": {"$lt": last_id}},
+    ]}
+
+def search_pipeline(kind: str, q: str, limit: int, cursor=None):
+    _, date_field = SEARCHABLE[kind]
+    pipeline = [
+        {"$match": {"$text": {"$search": q}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    after = _after(kind, cursor)
+    if after:
+        pipeline.append({"$match": after})
+    pipeline += [
+        {"$sort": {"score": -1, "_id": -1}},
+        {"$limit": limit},
+        {"$project": {
+            "kind": {"$literal": kind},
+            "score": 1,
+            "title": 1,
+            "content": 1,
+            "created_at": f"${date_field}",
+            "user_id": 1,
+            "author": 1,
+            "like_count": 1,
+            "comment_count": 1,
+        }},
+    ]
+    return pipeline
+
+def _decode_search_cursor(cursor: str):
+    values = decode_cursor(cursor)
+    if (len(values) != 3 or not isinstance(values[0], (int, float))
+            or values[1] not in SEARCHABLE or not isinstance(values[2], ObjectId)):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+async def search(q: str, kinds: List[str], limit: int, cursor: Optional[str] = None):
+    """One relevance-ranked page across the requested collections.
+
+    Each collection is queried concurrently for limit + 1 hits past the
+    cursor; merging those is enough to fill the page and to know whether
+    another page exists.
+    """
+    position = _decode_search_cursor(cursor) if cursor else None
+    batches = await asyncio.gather(*(
+        db[SEARCHABLE[kind][0]].aggregate(search_pipeline(kind, q, limit + 1, position)).to_list(limit + 1)
+        for kind in kinds
+    ))
+    merged = sorted((doc for batch in batches for doc in batch), key=_sort_key)
+    page = merged[:limit]
+    cursor_out = None
+    if len(merged) > limit:
+        last = page[-1]
+        cursor_out = encode_cursor(last["score"], last["kind"], last["_id"])
+    await hydrate_authors(page)
+    return {"results": page, "next_cursor": cursor_out}
+
+@router.get("/search", response_model=SearchPage)
+async def search_content(
+    q: str = Query(..., min_length=1, max_length=200),
+    kinds: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    user=Depends(get_current_user),
+):
+    try:
+        wanted = sorted(SEARCHABLE) if not kinds else sorted({k.strip() for k in kinds.split(",") if k.strip()})
+        unknown = [k for k in wanted if k not in SEARCHABLE]
+        if unknown or not wanted:
+            raise HTTPException(status_code=400, detail=f"Unknown search kinds: {', '.join(unknown) or kinds}")
+        return await search(q, wanted, clamp_limit(limit), cursor)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to search: {str(e)}")
@@ -0,0 +1,112 @@
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Annotated, Any
+import msgpack
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BeforeValidator
+
+# Routes declare response models, so FastAPI serializes documents with
+# pydantic-core instead of walking them with jsonable_encoder, and the result
+# is rendered by orjson. Raw documents handed straight to FastJSONResponse
+# also work: ObjectIds become strings, datetimes ISO 8601 strings.
+#
+# Clients that send Accept: application/msgpack get the same payload as
+# MessagePack instead. ContentNegotiationMiddleware picks the format per
+# request and NegotiatedResponse, the app-wide default, renders it.
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+MEDIA_TYPES = {
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/json": "json",
+    "application/*": "json",
+    "*/*": "json",
+}
+
+response_format: ContextVar[str] = ContextVar("response_format", default="json")
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def _msgpack_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Type is not MessagePack serializable: {type(value).__name__}")
+
+def pack(content: Any) -> bytes:
+    return msgpack.packb(content, default=_msgpack_default, use_bin_type=True)
+
+def negotiate(accept: str) -> str:
+    """The format the Accept header prefers; ties go to the range listed first."""
+    best, best_q = "json", -1.0
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        fmt = MEDIA_TYPES.get(media_type.lower())
+        if fmt is None:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        # q=0 means "not acceptable", never a weak preference.
+        if q <= 0:
+            continue
+        if q > best_q:
+            best, best_q = fmt, q
+    return best
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+class NegotiatedResponse(FastJSONResponse):
+    def render(self, content: Any) -> bytes:
+        if response_format.get() == "msgpack":
+            # init_headers runs after render, so this sets the Content-Type too.
+            self.media_type = MSGPACK_MEDIA_TYPE
+            return pack(content)
+        return super().render(content)
+
+class ContentNegotiationMiddleware:
+    """Pure ASGI: records the negotiated format for the request and adds Vary: Accept."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"accept"), "")
+        token = response_format.set(negotiate(accept) if accept else "json")
+
+        async def send_with_vary(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                for index, (name, value) in enumerate(headers):
+                    if name.lower() == b"vary":
+                        headers[index] = (name, value + b", Accept")
+                        break
+                else:
+                    headers.append((b"vary", b"Accept"))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_vary)
+        finally:
+            response_format.reset(token)
+
+# A Mongo ObjectId in, its hex string out.
+ObjectIdStr = Annotated[str, BeforeValidator(lambda value: str(value) if isinstance(value, ObjectId) else value)]
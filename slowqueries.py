@@ -0,0 +1,275 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Optional
+from pymongo import monitoring
+from pymongo.errors import CollectionInvalid, PyMongoError
+from metrics import current_route
+
+# Mongo commands slower than SLOW_QUERY_MS are recorded with their shape (the
+# filter, sort and pipeline with every value replaced by its type), the route
+# that issued them and, for a sample, the query planner's winning plan. Plans
+# that scan a whole collection are flagged, so a missing index shows up here
+# before it shows up as latency.
+#
+# The listener runs on Motor's executor threads and only appends to a deque;
+# a task on the event loop explains and stores the samples in the capped
+# SlowQueries collection every few seconds.
+
+log = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+# Share of slow queries that get explained; the first one of each shape always does.
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0.1"))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "600"))
+SLOW_QUERY_FLUSH_SECONDS = float(os.getenv("SLOW_QUERY_FLUSH_SECONDS", "5"))
+SLOW_QUERIES_BYTES = int(os.getenv("SLOW_QUERIES_BYTES", str(16 * 1024 * 1024)))
+# Slow queries waiting to be stored; beyond this the oldest are dropped.
+SLOW_QUERY_BACKLOG = 1000
+
+COLLECTION = "SlowQueries"
+
+# command -> where its filter lives
+QUERY_FIELDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "aggregate": "pipeline",
+    "update": "updates",
+    "delete": "deletes",
+}
+# Driver and session fields that explain rejects or that make no difference to the plan.
+UNEXPLAINABLE_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern"}
+
+def normalize(value):
+    """The shape of a query: operators and field names kept, values replaced by their type."""
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = normalize(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return type(value).__name__
+
+def query_shape(command_name: str, command: dict) -> dict:
+    field = QUERY_FIELDS[command_name]
+    if command_name in ("update", "delete"):
+        # Only the first statement; bulk writes of different shapes are rare here.
+        statements = command.get(field) or [{}]
+        shape = {"filter": normalize(statements[0].get("q", {}))}
+        if command_name == "update":
+            shape["multi"] = bool(statements[0].get("multi"))
+        return shape
+    if command_name == "aggregate":
+        return {"pipeline": normalize(command.get(field, []))}
+    shape = {"filter": normalize(command.get(field, {}))}
+    if command.get("sort"):
+        shape["sort"] = dict(command["sort"])
+    return shape
+
+def shape_key(collection: str, command_name: str, shape: dict) -> str:
+    text = json.dumps([collection, command_name, shape], sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+def plan_stages(plan: dict) -> list:
+    """Stage names of a winning plan, from the root down."""
+    stages = []
+    while plan:
+        stages.append(plan.get("stage"))
+        children = plan.get("inputStages") or ([plan["inputStage"]] if "inputStage" in plan else [])
+        for child in children[1:]:
+            stages.extend(plan_stages(child))
+        plan = children[0] if children else None
+    return [stage for stage in stages if stage]
+
+def _winning_plan(explained: dict) -> dict:
+    planner = explained.get("queryPlanner")
+    if planner is None:
+        # Aggregations report the planner under their first ($cursor) stage.
+        for stage in explained.get("stages", []):
+            planner = stage.get("$cursor", {}).get("queryPlanner")
+            if planner:
+                break
+    planner = planner or {}
+    winning = planner.get("winningPlan", {})
+    # Slot-based engine plans nest the classic tree under queryPlan.
+    return winning.get("queryPlan", winning)
+
+class SlowQueryRecorder(monitoring.CommandListener):
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS):
+        self.threshold_ms = threshold_ms
+        self._started = {}
+        self._pending = deque(maxlen=SLOW_QUERY_BACKLOG)
+        self._explained = {}
+        self._task: Optional[asyncio.Task] = None
+        self._db = None
+
+    def started(self, event):
+        if event.command_name in QUERY_FIELDS:
+            self._started[(event.connection_id, event.request_id)] = event.command
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        command = self._started.pop((event.connection_id, event.request_id), None)
+        if command is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms:
+            return
+        self._pending.append({
+            "database": event.database_name,
+            "command_name": event.command_name,
+            "command": command,
+            "duration_ms": duration_ms,
+            "route": current_route() or "background",
+            "recorded_at": datetime.utcnow(),
+        })
+
+    async def start(self, database):
+        self._db = database
+        try:
+            await database.create_collection(COLLECTION, capped=True, size=SLOW_QUERIES_BYTES)
+        except CollectionInvalid:
+            pass
+        except (PyMongoError, NotImplementedError) as e:
+            # Recording still works, only without the size cap; in-memory
+            # stand-ins such as mongomock do not support capped collections.
+            log.warning("Slow queries: could not create capped %s: %s", COLLECTION, e)
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(SLOW_QUERY_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                log.exception("Slow queries: flush failed: %s", e)
+
+    def _should_explain(self, key: str) -> bool:
+        last = self._explained.get(key)
+        if last is not None and time.monotonic() - last < SLOW_QUERY_EXPLAIN_INTERVAL:
+            return False
+        return last is None or random.random() < SLOW_QUERY_EXPLAIN_RATE
+
+    async def _explain(self, database: str, command: dict) -> Optional[dict]:
+        explainable = {key: value for key, value in command.items()
+                       if not key.startswith("$") and key not in UNEXPLAINABLE_FIELDS}
+        try:
+            explained = await self._db.client[database].command(
+                {"explain": explainable, "verbosity": "queryPlanner"}
+            )
+        except PyMongoError as e:
+            return {"error": str(e)}
+        stages = plan_stages(_winning_plan(explained))
+        return {"stages": stages, "collscan": "COLLSCAN" in stages}
+
+    async def flush(self):
+        if self._db is None or not self._pending:
+            return
+        samples = []
+        while self._pending:
+            sample = self._pending.popleft()
+            command_name = sample.pop("command_name")
+            command = sample.pop("command")
+            collection = command.get(command_name)
+            shape = query_shape(command_name, command)
+            key = shape_key(collection, command_name, shape)
+            sample.update({
+                "shape_key": key,
+                "collection": collection,
+                "command": command_name,
+                "shape": json.dumps(shape, sort_keys=True),
+            })
+            if self._should_explain(key):
+                self._explained[key] = time.monotonic()
+                sample["plan"] = await self._explain(sample["database"], command)
+            samples.append(sample)
+        await self._db[COLLECTION].insert_many(samples, ordered=False)
+
+slow_query_recorder = SlowQueryRecorder()
+
+async def slow_query_report(database, since_minutes: Optional[int] = None, collscan_only: bool = False, limit: int = 50):
+    """Recorded slow queries grouped by shape, slowest in total first."""
+    match = {}
+    if since_minutes:
+        match["recorded_at"] = {"$gte": datetime.utcnow() - timedelta(minutes=since_minutes)}
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"recorded_at": 1}},
+        {"$group": {
+            "_id": "$shape_key",
+            "collection": {"$last": "$collection"},
+            "command": {"$last": "$command"},
+            "shape": {"$last": "$shape"},
+            "routes": {"$addToSet": "$route"},
+            "count": {"$sum": 1},
+            "total_ms": {"$sum": "$duration_ms"},
+            "max_ms": {"$max": "$duration_ms"},
+            "last_seen": {"$last": "$recorded_at"},
+            "plans": {"$push": "$plan"},
+        }},
+    ]
+    rows = await database[COLLECTION].aggregate(pipeline).to_list(None)
+    report = []
+    for row in rows:
+        plans = [plan for plan in row.pop("plans") if plan and "stages" in plan]
+        plan = plans[-1] if plans else None
+        row.update({
+            "shape_key": row.pop("_id"),
+            "routes": sorted(row["routes"]),
+            "avg_ms": row["total_ms"] / row["count"],
+            "plan": plan["stages"] if plan else None,
+            "collscan": plan["collscan"] if plan else None,
+        })
+        if collscan_only and not row["collscan"]:
+            continue
+        report.append(row)
+    report.sort(key=lambda row: row["total_ms"], reverse=True)
+    return report[:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the slow Mongo queries recorded by the app")
+    parser.add_argument("--since", type=int, metavar="MINUTES", help="only queries recorded in the last MINUTES")
+    parser.add_argument("--collscan", action="store_true", help="only shapes whose plan scans a whole collection")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    from db import db
+
+    async def run():
+        report = await slow_query_report(db, args.since, args.collscan, args.limit)
+        if not report:
+            print("No slow queries recorded")
+        for row in report:
+            flag = " COLLSCAN" if row["collscan"] else ""
+            print(f"{row['collection']}.{row['command']}{flag}: {row['count']}x "
+                  f"avg={row['avg_ms']:.1f}ms max={row['max_ms']:.1f}ms routes={','.join(row['routes'])}")
+            print(f"    shape={row['shape']} plan={row['plan']}")
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import math
+import os
+import re
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Response
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from app import get_current_user, db
+from authors import hydrate_authors
+from engagement import FeedItem, cached_page, feed_stages, present_feed
+from indexes import register_index
+from jobs import job_handler
+from pagination import NEXT_CURSOR_HEADER, clamp_limit, decode_cursor, keyset_sort, next_cursor, page_query
+
+router = APIRouter()
+
+# Home timelines are materialized in Timelines, one entry per (user, post).
+# The fanout_post job writes them when a post is created, for the author, the
+# users who have liked the author before and the users whose interests the
+# post mentions. Entries are ranked by recency plus those affinities, so
+# reading a page is a single range scan of (user_id, rank) joined to Posts.
+
+TIMELINE_TTL_DAYS = int(os.getenv("TIMELINE_TTL_DAYS", "30"))
+# Ranks are seconds since the epoch; each boost makes a post rank as if it were this much newer.
+AFFINITY_BOOST_SECONDS = float(os.getenv("TIMELINE_AFFINITY_BOOST_SECONDS", str(6 * 3600)))
+INTEREST_BOOST_SECONDS = float(os.getenv("TIMELINE_INTEREST_BOOST_SECONDS", str(3 * 3600)))
+# Likes on the author's most recent posts that count towards affinity.
+AFFINITY_WINDOW = 200
+MAX_POST_TAGS = 256
+FANOUT_BATCH = 1000
+# Timeline entries a user needs before /home stops falling back to the global feed.
+TIMELINE_MIN_ENTRIES = int(os.getenv("TIMELINE_MIN_ENTRIES", "100"))
+
+EPOCH = datetime(1970, 1, 1)
+
+register_index("Timelines", [("user_id", ASCENDING), ("rank", DESCENDING), ("post_id", DESCENDING)])
+register_index("Timelines", [("user_id", ASCENDING), ("post_id", ASCENDING)], unique=True)
+register_index("Timelines", [("post_id", ASCENDING)])
+register_index("Timelines", [("created_at", ASCENDING)], expireAfterSeconds=TIMELINE_TTL_DAYS * 24 * 3600)
+register_index("Users", [("interest_tags", ASCENDING)])
+
+# Common English words of three letters or more. Nearly every post and profile
+# has some, so as tags they would fan every post out to most users.
+STOPWORDS = frozenset("""
+    about above after again against all also and any are because been before being below
+    between both but can could did does doing down during each few for from further had has
+    have having her here hers herself him himself his how into its itself just let more most
+    much not now off once only other our ours ourselves out over own same she should some
+    such than that the their theirs them themselves then there these they this those through
+    too under until very was were what when where which while who whom why will with would
+    you your yours yourself yourselves get got like really
+""".split())
+
+def interest_tags(values: Iterable[str]) -> List[str]:
+    """Normalized words for matching interests against posts: lowercase, three characters or more, no stopwords."""
+    return sorted({
+        word for value in values for word in re.findall(r"[a-z0-9]+", (value or "").lower())
+        if len(word) >= 3 and word not in STOPWORDS
+    })
+
+def timeline_rank(created_at: datetime, author_likes: int, shared_interests: int) -> float:
+    return ((created_at - EPOCH).total_seconds()
+            + AFFINITY_BOOST_SECONDS * math.log2(1 + author_likes)
+            + INTEREST_BOOST_SECONDS * shared_interests)
+
+async def _author_affinities(author_id: str) -> Dict[str, int]:
+    """uid -> how many of the author's recent posts they liked."""
+    rows = await db.Posts.aggregate([
+        {"$match": {"user_id": author_id}},
+        {"$sort": {"created_at": -1}},
+        {"$limit": AFFINITY_WINDOW},
+        {"$unwind": "$likes"},
+        {"$group": {"_id": "$likes", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    return {row["_id"]: row["count"] for row in rows}
+
+async def _interest_overlaps(tags: List[str]):
+    """Batches of (uid, how many of the tags are among their interests).
+
+    Users are streamed, so a popular tag never loads every matching user at once.
+    """
+    if not tags:
+        return
+    wanted = set(tags)
+    cursor = db.Users.find(
+        {"interest_tags": {"$in": tags}}, {"_id": 0, "firebase_uid": 1, "interest_tags": 1}
+    ).batch_size(FANOUT_BATCH)
+    batch = []
+    async for user in cursor:
+        if user.get("firebase_uid"):
+            batch.append((user["firebase_uid"], len(wanted.intersection(user["interest_tags"]))))
+        if len(batch) >= FANOUT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+@job_handler("fanout_post")
+async def fan_out_post(payload: dict):
+    post = await db.Posts.find_one(
+        {"_id": ObjectId(payload["post_id"])}, {"user_id": 1, "title": 1, "content": 1, "created_at": 1}
+    )
+    if post is None:
+        # Deleted before the job ran.
+        return
+    affinities = await _author_affinities(post["user_id"])
+
+    # Upserts keyed by (user_id, post_id), so a retried job rewrites the same entries.
+    def entry(uid: str, shared: int):
+        return UpdateOne(
+            {"user_id": uid, "post_id": post["_id"]},
+            {"$set": {
+                "rank": timeline_rank(post["created_at"], affinities.get(uid, 0), shared),
+                "created_at": post["created_at"],
+            }},
+            upsert=True,
+        )
+
+    reached = set()
+    tags = interest_tags([post.get("title"), post.get("content")])[:MAX_POST_TAGS]
+    async for batch in _interest_overlaps(tags):
+        await db.Timelines.bulk_write([entry(uid, shared) for uid, shared in batch], ordered=False)
+        reached.update(uid for uid, _ in batch)
+    rest = [uid for uid in set(affinities) | {post["user_id"]} if uid not in reached]
+    for start in range(0, len(rest), FANOUT_BATCH):
+        await db.Timelines.bulk_write([entry(uid, 0) for uid in rest[start:start + FANOUT_BATCH]], ordered=False)
+
+async def remove_from_timelines(post_id: ObjectId):
+    await db.Timelines.delete_many({"post_id": post_id})
+
+def timeline_pipeline(uid: str, cursor: Optional[str], limit: int):
+    return [
+        {"$match": page_query({"user_id": uid}, "rank", cursor, tiebreak="post_id")},
+        {"$sort": {"rank": -1, "post_id": -1}},
+        {"$limit": limit},
+        {"$lookup": {"from": "Posts", "localField": "post_id", "foreignField": "_id", "as": "post"}},
+        # Entries whose post is gone are kept until after paging so the cursor stays right.
+        {"$addFields": {"deleted": {"$eq": [{"$size": "$post"}, 0]}}},
+        {"$unwind": {"path": "$post", "preserveNullAndEmptyArrays": True}},
+        {"$addFields": {"post._id": "$post_id", "post.rank": "$rank", "post.deleted": "$deleted"}},
+        {"$replaceRoot": {"newRoot": "$post"}},
+        *feed_stages(uid),
+    ]
+
+@router.get("/home", response_model=List[FeedItem])
+async def get_home_feed(response: Response, cursor: Optional[str] = None, limit: int = 100, user=Depends(get_current_user)):
+    try:
+        limit = clamp_limit(limit)
+        uid = user["uid"]
+        # Timeline cursors start with a rank, global-feed cursors with a datetime.
+        values = decode_cursor(cursor) if cursor else []
+        global_cursor = bool(values) and isinstance(values[0], datetime)
+
+        if cursor:
+            personal = not global_cursor
+        else:
+            # A first page picks the mode; later pages follow their cursor.
+            entries = await db.Timelines.count_documents({"user_id": uid}, limit=TIMELINE_MIN_ENTRIES)
+            personal = entries >= TIMELINE_MIN_ENTRIES
+
+        if personal:
+            rows = await db.Timelines.aggregate(timeline_pipeline(uid, cursor, limit)).to_list(limit)
+            cursor_out = next_cursor(rows, "rank", limit)
+            if cursor_out:
+                response.headers[NEXT_CURSOR_HEADER] = cursor_out
+            return await hydrate_authors([row for row in rows if not row["deleted"]])
+
+        # Too little has been fanned out to this user yet, mostly their own
+        # posts: the global feed is a better home page.
+        tag, page = await cached_page(db.Posts, page_query({}, "created_at", cursor), sort=keyset_sort("created_at"), limit=limit)
+        cursor_out = next_cursor(page, "created_at", limit)
+        if cursor_out:
+            response.headers[NEXT_CURSOR_HEADER] = cursor_out
+        return await present_feed(db.Posts, page, uid)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch home feed: {str(e)}")
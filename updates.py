@@ -1,340 +1,278 @@
-from fastapi import APIRouter, Depends, HTTPException
-from bson import ObjectId
-from datetime import datetime
-from pydantic import BaseModel
-from typing import Optional
-from app import get_current_user, db
-
-router = APIRouter()
-
-class UpdateModel(BaseModel):
-    title: str
-    content: str
-    image_url: Optional[str] = None
-
-class CommentModel(BaseModel):
-    content: str
-
-async def get_user_profile(firebase_uid: str):
-    user_data = await db.Users.find_one({"firebase_uid": firebase_uid})
-    if not user_data:
-        raise HTTPException(status_code=404, detail="User profile not found")
-    return user_data
-
-
-@router.post("/add_updates")  
-async def create_update(update: UpdateModel, user=Depends(get_current_user)):
-    try:
-        user_profile = await get_user_profile(user["uid"])
-        username = user_profile.get("username", user["email"])
-
-        update_data = {
-            "user_id": user["uid"],
-            "username": username,
-            "title": update.title,
-            "content": update.content,
-            "image_url": update.image_url or "",
-            "created_at": datetime.utcnow(),
-            "likes": [],
-            "saves": [],
-            "comments": []
-        }
-
-        result = await db.Updates.insert_one(update_data)
-        return {"message": "Update created", "update_id": str(result.inserted_id)}
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to create update: {str(e)}")
-
-@router.get("/blog")
-async def get_all_updates(user=Depends(get_current_user), page: int = 1, limit: int = 10):
-    try:
-        skip = (page - 1) * limit
-        updates = await db.Updates.find().sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-
-        for update in updates:
-            update["_id"] = str(update["_id"])
-            update["liked"] = user["uid"] in update.get("likes", [])
-            update["saved"] = user["uid"] in update.get("saves", [])
-            update["like_count"] = len(update.get("likes", []))
-            update["save_count"] = len(update.get("saves", []))
-            update["comment_count"] = len(update.get("comments", []))
-
-        return updates
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch updates: {str(e)}")
-
-@router.get("/my-updates")
-async def get_my_updates(user=Depends(get_current_user)):
-    try:
-        updates = await db.Updates.find({"user_id": user["uid"]}).sort("created_at", -1).to_list(100)
-
-        for update in updates:
-            update["_id"] = str(update["_id"])
-            update["like_count"] = len(update.get("likes", []))
-            update["save_count"] = len(update.get("saves", []))
-            update["comment_count"] = len(update.get("comments", []))
-
-        return updates
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch user updates: {str(e)}")
-
-@router.get("/updates/{update_id}")
-async def get_update(update_id: str, user=Depends(get_current_user)):
-    try:
-        if not ObjectId.is_valid(update_id):
-            raise HTTPException(status_code=400, detail="Invalid update ID")
-
-        update = await db.Updates.find_one({"_id": ObjectId(update_id)})
-        if not update:
-            raise HTTPException(status_code=404, detail="Update not found")
-
-        update["_id"] = str(update["_id"])
-        update["liked"] = user["uid"] in update.get("likes", [])
-        update["saved"] = user["uid"] in update.get("saves", [])
-        update["like_count"] = len(update.get("likes", []))
-        update["save_count"] = len(update.get("saves", []))
-        update["comment_count"] = len(update.get("comments", []))
-
-        return update
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch update: {str(e)}")
-
-@router.delete("/updates/{update_id}")
-async def delete_update(update_id: str, user=Depends(get_current_user)):
-    try:
-        if not ObjectId.is_valid(update_id):
-            raise HTTPException(status_code=400, detail="Invalid update ID")
-
-        update = await db.Updates.find_one({"_id": ObjectId(update_id)})
-        if not update:
-            raise HTTPException(status_code=404, detail="Update not found")
-
-        if update["user_id"] != user["uid"]:
-            raise HTTPException(status_code=403, detail="You can only delete your own updates")
-
-        await db.Updates.delete_one({"_id": ObjectId(update_id)})
-
-        await db.Users.update_many(
-            {},
-            {"$pull": {"liked_updates": ObjectId(update_id), "saved_updates": ObjectId(update_id)}}
-        )
-
-        return {"message": "Update deleted successfully"}
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to delete update: {str(e)}")
-
-
-@router.post("/updates/{update_id}/like")
-async def like_update(update_id: str, user=Depends(get_current_user)):
-    try:
-        if not ObjectId.is_valid(update_id):
-            raise HTTPException(status_code=400, detail="Invalid update ID")
-
-        update = await db.Updates.find_one({"_id": ObjectId(update_id)})
-        if not update:
-            raise HTTPException(status_code=404, detail="Update not found")
-
-        await db.Updates.update_one(
-            {"_id": ObjectId(update_id)},
-            {"$addToSet": {"likes": user["uid"]}}
-        )
-
-        await db.Users.update_one(
-            {"firebase_uid": user["uid"]},
-            {"$addToSet": {"liked_updates": ObjectId(update_id)}}
-        )
-
-        return {"message": "Update liked successfully"}
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to like update: {str(e)}")
-
-@router.post("/updates/{update_id}/unlike")
-async def unlike_update(update_id: str, user=Depends(get_current_user)):
-    try:
-        if not ObjectId.is_valid(update_id):
-            raise HTTPException(status_code=400, detail="Invalid update ID")
-
-        await db.Updates.update_one(
-            {"_id": ObjectId(update_id)},
-            {"$pull": {"likes": user["uid"]}}
-        )
-
-        await db.Users.update_one(
-            {"firebase_uid": user["uid"]},
-            {"$pull": {"liked_updates": ObjectId(update_id)}}
-        )
-
-        return {"message": "Update unliked successfully"}
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to unlike update: {str(e)}")
-
-@router.post("/updates/{update_id}/save")
-async def save_update(update_id: str, user=Depends(get_current_user)):
-    try:
-        if not ObjectId.is_valid(update_id):
-            raise HTTPException(status_code=400, detail="Invalid update ID")
-
-        update = await db.Updates.find_one({"_id": ObjectId(update_id)})
-        if not update:
-            raise HTTPException(status_code=404, detail="Update not found")
-
-        await db.Updates.update_one(
-            {"_id": ObjectId(update_id)},
-            {"$addToSet": {"saves": user["uid"]}}
-        )
-
-        await db.Users.update_one(
-            {"firebase_uid": user["uid"]},
-            {"$addToSet": {"saved_updates": ObjectId(update_id)}}
-        )
-
-        return {"message": "Update saved successfully"}
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to save update: {str(e)}")
-
-@router.post("/updates/{update_id}/unsave")
-async def unsave_update(update_id: str, user=Depends(get_current_user)):
-    try:
-        if not ObjectId.is_valid(update_id):
-            raise HTTPException(status_code=400, detail="Invalid update ID")
-
-        await db.Updates.update_one(
-            {"_id": ObjectId(update_id)},
-            {"$pull": {"saves": user["uid"]}}
-        )
-
-        await db.Users.update_one(
-            {"firebase_uid": user["uid"]},
-            {"$pull": {"saved_updates": ObjectId(update_id)}}
-        )
-
-        return {"message": "Update unsaved successfully"}
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to unsave update: {str(e)}")
-
-@router.post("/updates/{update_id}/comment")
-async def comment_update(update_id: str, comment: CommentModel, user=Depends(get_current_user)):
-    try:
-        if not ObjectId.is_valid(update_id):
-            raise HTTPException(status_code=400, detail="Invalid update ID")
-
-        update = await db.Updates.find_one({"_id": ObjectId(update_id)})
-        if not update:
-            raise HTTPException(status_code=404, detail="Update not found")
-
-        user_profile = await get_user_profile(user["uid"])
-        username = user_profile.get("username", user["email"])
-
-        comment_data = {
-            "comment_id": str(ObjectId()),
-            "user_id": user["uid"],
-            "username": username,
-            "content": comment.content,
-            "timestamp": datetime.utcnow()
-        }
-
-        await db.Updates.update_one(
-            {"_id": ObjectId(update_id)},
-            {"$push": {"comments": comment_data}}
-        )
-
-        return {"message": "Comment added successfully", "comment": comment_data}
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to add comment: {str(e)}")
-
-@router.get("/updates/{update_id}/comments")
-async def get_update_comments(update_id: str, user=Depends(get_current_user)):
-    try:
-        if not ObjectId.is_valid(update_id):
-            raise HTTPException(status_code=400, detail="Invalid update ID")
-
-        update = await db.Updates.find_one({"_id": ObjectId(update_id)}, {"comments": 1})
-        if not update:
-            raise HTTPException(status_code=404, detail="Update not found")
-
-        comments = update.get("comments", [])
-        comments.sort(key=lambda x: x.get("timestamp", datetime.min), reverse=True)
-
-        return {"comments": comments}
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch comments: {str(e)}")
-
-
-@router.get("/my-liked-updates")
-async def get_my_liked_updates(user=Depends(get_current_user)):
-    try:
-        user_data = await db.Users.find_one({"firebase_uid": user["uid"]})
-        if not user_data:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        liked_update_ids = user_data.get("liked_updates", [])
-        if not liked_update_ids:
-            return []
-
-        updates = await db.Updates.find({"_id": {"$in": liked_update_ids}}).sort("created_at", -1).to_list(100)
-
-        for update in updates:
-            update["_id"] = str(update["_id"])
-            update["liked"] = True
-            update["saved"] = user["uid"] in update.get("saves", [])
-            update["like_count"] = len(update.get("likes", []))
-            update["save_count"] = len(update.get("saves", []))
-            update["comment_count"] = len(update.get("comments", []))
-
-        return updates
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch liked updates: {str(e)}")
-
-@router.get("/my-saved-updates")
-async def get_my_saved_updates(user=Depends(get_current_user)):
-    try:
-        user_data = await db.Users.find_one({"firebase_uid": user["uid"]})
-        if not user_data:
-            raise HTTPException(status_code=404, detail="User not found")
-
-        saved_update_ids = user_data.get("saved_updates", [])
-        if not saved_update_ids:
-            return []
-
-        updates = await db.Updates.find({"_id": {"$in": saved_update_ids}}).sort("created_at", -1).to_list(100)
-
-        for update in updates:
-            update["_id"] = str(update["_id"])
-            update["liked"] = user["uid"] in update.get("likes", [])
-            update["saved"] = True
-            update["like_count"] = len(update.get("likes", []))
-            update["save_count"] = len(update.get("saves", []))
-            update["comment_count"] = len(update.get("comments", []))
-
-        return updates
-
-    except Exception as e:
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from bson import ObjectId
+from datetime import datetime
+from pydantic import BaseModel
+from typing import List, Optional
+from pymongo import ASCENDING, DESCENDING
+from app import get_current_user, db
+from authors import hydrate_authors
+from pagination import NEXT_CURSOR_HEADER, clamp_limit, keyset_sort, next_cursor, page_query
+from engagement import FeedItem, cached_page, delete_edges, fetch_engaged, fetch_feed, flags_marker, toggle_engagement, viewer_flags
+from etags import conditional, feed_etag
+from feedcache import feed_cache
+from comments import CommentCreated, CommentPage, add_comment, list_comments, delete_comments
+from indexes import register_index
+from jobs import job_handler, job_queue
+
+router = APIRouter()
+
+register_index("Updates", [("created_at", DESCENDING), ("_id", DESCENDING)])
+register_index("Updates", [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)])
+
+class UpdateModel(BaseModel):
+    title: str
+    content: str
+    image_url: Optional[str] = None
+
+class CommentModel(BaseModel):
+    content: str
+
+
+@job_handler("cleanup_update")
+async def cleanup_deleted_update(payload: dict):
+    update_id = ObjectId(payload["update_id"])
+    await delete_comments(update_id)
+    await delete_edges(update_id)
+
+@router.post("/add_updates")  
+async def create_update(update: UpdateModel, user=Depends(get_current_user)):
+    try:
+        update_data = {
+            "user_id": user["uid"],
+            "title": update.title,
+            "content": update.content,
+            "image_url": update.image_url or "",
+            "created_at": datetime.utcnow(),
+            "likes": [],
+            "saves": [],
+            "like_count": 0,
+            "save_count": 0,
+            "comment_count": 0
+        }
+
+        result = await db.Updates.insert_one(update_data)
+        feed_cache.invalidate("Updates")
+        return {"message": "Update created", "update_id": str(result.inserted_id)}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create update: {str(e)}")
+
+@router.get("/blog", response_model=List[FeedItem])
+async def get_all_updates(request: Request, response: Response, user=Depends(get_current_user), cursor: Optional[str] = None, page: int = 1, limit: int = 10):
+    try:
+        limit = clamp_limit(limit)
+        # Offset paging is kept for older clients; cursors stay flat at any depth.
+        skip = (page - 1) * limit if not cursor and page > 1 else 0
+        tag, page = await cached_page(
+            db.Updates, page_query({}, "created_at", cursor), sort=keyset_sort("created_at"),
+            limit=limit, skip=skip
+        )
+
+        cursor_out = next_cursor(page, "created_at", limit)
+        if cursor_out:
+            response.headers[NEXT_CURSOR_HEADER] = cursor_out
+
+        page = await viewer_flags(db.Updates, page, user["uid"])
+        not_modified = conditional(request, response, feed_etag("Updates", tag, user["uid"], flags_marker(page)))
+        if not_modified:
+            return not_modified
+
+        return await hydrate_authors(page)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch updates: {str(e)}")
+
+@router.get("/my-updates", response_model=List[FeedItem])
+async def get_my_updates(user=Depends(get_current_user)):
+    try:
+        updates = await fetch_feed(db.Updates, {"user_id": user["uid"]}, sort=keyset_sort("created_at"), limit=100)
+
+        return updates
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch user updates: {str(e)}")
+
+@router.get("/updates/{update_id}", response_model=FeedItem)
+async def get_update(update_id: str, user=Depends(get_current_user)):
+    try:
+        if not ObjectId.is_valid(update_id):
+            raise HTTPException(status_code=400, detail="Invalid update ID")
+
+        updates = await fetch_feed(db.Updates, {"_id": ObjectId(update_id)}, limit=1, viewer_uid=user["uid"])
+        if not updates:
+            raise HTTPException(status_code=404, detail="Update not found")
+
+        return updates[0]
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch update: {str(e)}")
+
+@router.delete("/updates/{update_id}")
+async def delete_update(update_id: str, user=Depends(get_current_user)):
+    try:
+        if not ObjectId.is_valid(update_id):
+            raise HTTPException(status_code=400, detail="Invalid update ID")
+
+        update = await db.Updates.find_one({"_id": ObjectId(update_id)}, {"user_id": 1})
+        if not update:
+            raise HTTPException(status_code=404, detail="Update not found")
+
+        if update["user_id"] != user["uid"]:
+            raise HTTPException(status_code=403, detail="You can only delete your own updates")
+
+        await db.Updates.delete_one({"_id": ObjectId(update_id)})
+        feed_cache.invalidate("Updates")
+
+        # Comments and like/save edges are cleaned up in the background.
+        await job_queue.enqueue(
+            "cleanup_update",
+            {"update_id": update_id},
+            dedupe_key=f"cleanup_update:{update_id}"
+        )
+
+        return {"message": "Update deleted successfully"}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to delete update: {str(e)}")
+
+
+@router.post("/updates/{update_id}/like")
+async def like_update(update_id: str, user=Depends(get_current_user)):
+    try:
+        if not ObjectId.is_valid(update_id):
+            raise HTTPException(status_code=400, detail="Invalid update ID")
+
+        result = await toggle_engagement(db.Updates, ObjectId(update_id), user["uid"], "like", True, "liked_updates")
+        if result is None:
+            raise HTTPException(status_code=404, detail="Update not found")
+
+        return {"message": "Update liked successfully", **result}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to like update: {str(e)}")
+
+@router.post("/updates/{update_id}/unlike")
+async def unlike_update(update_id: str, user=Depends(get_current_user)):
+    try:
+        if not ObjectId.is_valid(update_id):
+            raise HTTPException(status_code=400, detail="Invalid update ID")
+
+        result = await toggle_engagement(db.Updates, ObjectId(update_id), user["uid"], "like", False, "liked_updates")
+        if result is None:
+            raise HTTPException(status_code=404, detail="Update not found")
+
+        return {"message": "Update unliked successfully", **result}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to unlike update: {str(e)}")
+
+@router.post("/updates/{update_id}/save")
+async def save_update(update_id: str, user=Depends(get_current_user)):
+    try:
+        if not ObjectId.is_valid(update_id):
+            raise HTTPException(status_code=400, detail="Invalid update ID")
+
+        result = await toggle_engagement(db.Updates, ObjectId(update_id), user["uid"], "save", True, "saved_updates")
+        if result is None:
+            raise HTTPException(status_code=404, detail="Update not found")
+
+        return {"message": "Update saved successfully", **result}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to save update: {str(e)}")
+
+@router.post("/updates/{update_id}/unsave")
+async def unsave_update(update_id: str, user=Depends(get_current_user)):
+    try:
+        if not ObjectId.is_valid(update_id):
+            raise HTTPException(status_code=400, detail="Invalid update ID")
+
+        result = await toggle_engagement(db.Updates, ObjectId(update_id), user["uid"], "save", False, "saved_updates")
+        if result is None:
+            raise HTTPException(status_code=404, detail="Update not found")
+
+        return {"message": "Update unsaved successfully", **result}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to unsave update: {str(e)}")
+
+@router.post("/updates/{update_id}/comment", response_model=CommentCreated)
+async def comment_update(update_id: str, comment: CommentModel, user=Depends(get_current_user)):
+    try:
+        if not ObjectId.is_valid(update_id):
+            raise HTTPException(status_code=400, detail="Invalid update ID")
+
+        update = await db.Updates.find_one({"_id": ObjectId(update_id)}, {"_id": 1})
+        if not update:
+            raise HTTPException(status_code=404, detail="Update not found")
+
+        comment_data = await add_comment(db.Updates, "update", ObjectId(update_id), user["uid"], comment.content)
+
+        return {"message": "Comment added successfully", "comment": comment_data}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to add comment: {str(e)}")
+
+@router.get("/updates/{update_id}/comments", response_model=CommentPage)
+async def get_update_comments(update_id: str, cursor: Optional[str] = None, limit: int = 20, user=Depends(get_current_user)):
+    try:
+        if not ObjectId.is_valid(update_id):
+            raise HTTPException(status_code=400, detail="Invalid update ID")
+
+        update = await db.Updates.find_one({"_id": ObjectId(update_id)}, {"_id": 1})
+        if not update:
+            raise HTTPException(status_code=404, detail="Update not found")
+
+        return await list_comments(ObjectId(update_id), cursor, limit)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch comments: {str(e)}")
+
+
+@router.get("/my-liked-updates", response_model=List[FeedItem])
+async def get_my_liked_updates(response: Response, cursor: Optional[str] = None, limit: int = 100, user=Depends(get_current_user)):
+    try:
+        updates, cursor_out = await fetch_engaged(db.Updates, user["uid"], "liked_updates", cursor, clamp_limit(limit))
+
+        if cursor_out:
+            response.headers[NEXT_CURSOR_HEADER] = cursor_out
+
+        return updates
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch liked updates: {str(e)}")
+
+@router.get("/my-saved-updates", response_model=List[FeedItem])
+async def get_my_saved_updates(response: Response, cursor: Optional[str] = None, limit: int = 100, user=Depends(get_current_user)):
+    try:
+        updates, cursor_out = await fetch_engaged(db.Updates, user["uid"], "saved_updates", cursor, clamp_limit(limit))
+
+        if cursor_out:
+            response.headers[NEXT_CURSOR_HEADER] = cursor_out
+
+        return updates
+
+    except HTTPException:
+        raise
+    except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch saved updates: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+from pymongo.errors import BulkWriteError, PyMongoError
+
+# Buffers inserts in memory and writes them with insert_many, either when a
+# batch fills up or when the oldest buffered document has waited long enough.
+# The queue is bounded: once it is full, put() waits for the flusher to catch
+# up instead of letting memory grow.
+
+log = logging.getLogger(__name__)
+
+class WriteBehindQueue:
+    def __init__(self, collection, max_batch: int = 500, flush_interval: float = 0.2,
+                 max_pending: int = 10000, max_retries: int = 3):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._task: Optional[asyncio.Task] = None
+        self._current: list = []
+        self.stats = {
+            "enqueued": 0,
+            "written": 0,
+            "failed": 0,
+            "batches": 0,
+            "retries": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    def metrics(self) -> dict:
+        return {**self.stats, "pending": self.queue.qsize()}
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, document: dict):
+        await self.queue.put(document)
+        self.stats["enqueued"] += 1
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = self._current = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+            self._current = []
+
+    async def _flush(self, batch: list):
+        started = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.collection.insert_many(batch, ordered=False)
+                break
+            except BulkWriteError as e:
+                # insert_many assigns _id before sending, so on a retry the
+                # documents that already made it come back as duplicates.
+                if all(err.get("code") == 11000 for err in e.details.get("writeErrors", [])):
+                    break
+                error = e
+            except PyMongoError as e:
+                error = e
+            except Exception as e:
+                # Not a server error (e.g. a document BSON cannot encode), so
+                # retrying will not help; the flusher must outlive it.
+                self.stats["failed"] += len(batch)
+                log.exception("Write-behind: dropping %d documents for %s: %s", len(batch), self.collection.name, e)
+                return
+            if attempt < self.max_retries:
+                self.stats["retries"] += 1
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        else:
+            self.stats["failed"] += len(batch)
+            log.error("Write-behind: dropping %d documents for %s: %s", len(batch), self.collection.name, error)
+            return
+        self.stats["written"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["last_batch_size"] = len(batch)
+        self.stats["last_flush_ms"] = (time.perf_counter() - started) * 1000
+
+    async def stop(self):
+        """Stop the background flusher and write out everything still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # A batch interrupted mid-insert is written again; duplicates are ignored.
+        batch, self._current = self._current, []
+        while not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+            if len(batch) >= self.max_batch:
+                await self._flush(batch)
+                batch = []
+        if batch:
+            await self._flush(batch)